@@ -0,0 +1,63 @@
+'''
+Per-message build cost of the confirm/reset mails.
+
+Run from login_docker/: python -m bench.mail_build [N]
+
+"cold" drops the per-process caches before every message, which is
+what each message cost before the skeleton and logo were cached.
+'''
+
+import os
+import sys
+from time import perf_counter
+
+os.environ.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ.setdefault('SENDER', 'bench@example.com')
+
+from server import app  # noqa: E402
+from src.mailer.mail import MailBody, ConfirmMail, ResetMail  # noqa: E402
+from src.mailer.outbox import OutboxMail, logo  # noqa: E402
+
+
+def build(cls):
+    '''Build a mail the way signup/reset do, plus its delivery message.'''
+
+    msg = cls('bench@example.com')
+    row = OutboxMail(
+        sender=msg.sender,
+        recipients=','.join(msg.recipients),
+        subject=msg.subject,
+        html=msg.html
+    )
+    return row.message()
+
+
+def run(n, cold):
+
+    start = perf_counter()
+    for i in range(n):
+        if cold:
+            MailBody.skeletons.clear()
+            logo.cache_clear()
+        build(ConfirmMail if i % 2 else ResetMail)
+    return (perf_counter() - start) / n
+
+
+def main():
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app.config['SERVER_NAME'] = 'localhost'
+    with app.test_request_context():
+        build(ConfirmMail)
+        cold = run(n, cold=True)
+        warm = run(n, cold=False)
+
+    print('messages:   {}'.format(n))
+    print('cold build: {:8.1f} us/msg'.format(cold * 1e6))
+    print('warm build: {:8.1f} us/msg'.format(warm * 1e6))
+    print('speedup:    {:8.2f}x'.format(cold / warm))
+
+
+if __name__ == '__main__':
+    main()
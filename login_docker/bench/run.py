@@ -0,0 +1,500 @@
+'''
+Load test of the auth flows and microbenchmarks of their hot paths.
+
+Run from login_docker/:
+
+    python -m bench.run [--users N] [--requests N] [--concurrency N]
+                        [--database URI] [--output FILE]
+
+The app is built with create_app() against a fresh SQLite file (or the
+--database given, e.g. a local Postgres), seeded with --users confirmed
+users through CreateUser, and driven in process with one Flask test
+client per simulated browser. Mail is never delivered: the outbox
+dispatcher is off and queued mails are only counted. Social logins go
+through a local stub provider instead of authomatic.
+
+Cold start is measured in fresh interpreters: importing server (which
+runs create_app()) and the memory it leaves, migrating an empty
+database and the first request, plus the import time per package.
+
+Results go to bench/results/<commit>.json (or --output) so runs can be
+compared across commits.
+'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from time import perf_counter
+
+PASSWORD = 'bench-password'
+
+COLD_START = '''
+import json
+import resource
+from time import perf_counter
+start = perf_counter()
+from server import app
+imported = perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+from src.schema import migrations
+with app.app_context():
+    migrations.upgrade()
+migrated = perf_counter()
+client = app.test_client()
+client.get('/login/')
+first = perf_counter()
+client.get('/login/')
+print(json.dumps({
+    'import_ms': (imported - start) * 1e3,
+    'migrate_ms': (migrated - imported) * 1e3,
+    'first_request_ms': (first - migrated) * 1e3,
+    'second_request_ms': (perf_counter() - first) * 1e3,
+    'import_rss_mb': rss / 1024,
+}))
+'''
+
+# Packages listed in the import time breakdown.
+IMPORT_TOP = 12
+
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=1000,
+                        help='users seeded before the run')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='simulated browsers per scenario')
+    parser.add_argument('--database', help='SQLAlchemy URI, default SQLite')
+    parser.add_argument('--micro', type=int, default=200,
+                        help='iterations per microbenchmark')
+    parser.add_argument('--cold-starts', type=int, default=3,
+                        help='fresh interpreters timed for cold start')
+    parser.add_argument('--output', help='JSON results file')
+    return parser.parse_args()
+
+
+def configure(args):
+    '''Environment read by src.config, set before the app is imported.'''
+
+    args.sqlite = args.database is None
+    if args.sqlite:
+        args.database = 'sqlite:///' + temp_db()
+
+    os.environ['SQLALCHEMY_DATABASE_URI'] = args.database
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.setdefault('SENDER', 'bench@example.com')
+    os.environ['MAIL_DISPATCHER'] = 'off'
+    os.environ['SWEEPER'] = 'off'
+    os.environ['THROTTLE'] = 'False'
+    os.environ['SHARED_STORE'] = 'memory://'
+    os.environ['METRICS'] = 'False'
+
+
+def temp_db():
+
+    fd, path = tempfile.mkstemp(prefix='auth-bench-', suffix='.db')
+    os.close(fd)
+    return path
+
+
+def cold_start(args):
+    '''Median cold start timings over --cold-starts fresh interpreters.'''
+
+    runs = []
+    for _ in range(args.cold_starts):
+        env = dict(os.environ)
+        if args.sqlite:
+            env['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + temp_db()
+        out = subprocess.check_output(
+            [sys.executable, '-c', COLD_START], env=env)
+        runs.append(json.loads(out.decode().strip().splitlines()[-1]))
+
+    if not runs:
+        return {}
+    return {
+        key: round(statistics.median(run[key] for run in runs), 1)
+        for key in runs[0]
+    }
+
+
+def import_times():
+    '''Self import time in ms of `import server`, per top-level package.'''
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import server'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+
+    packages = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1e3
+
+    top = sorted(packages.items(), key=lambda item: -item[1])[:IMPORT_TOP]
+    return {package: round(ms, 1) for package, ms in top}
+
+
+def git_commit():
+    '''(commit, dirty) of the working tree, or (None, None).'''
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+        dirty = bool(subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no', '.'],
+            stderr=subprocess.DEVNULL
+        ).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def percentile(ordered, p):
+    '''Nearest-rank percentile of a sorted list.'''
+
+    if not ordered:
+        return None
+    rank = max(int(round(p / 100 * len(ordered) + .5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples, seconds):
+    '''Throughput and latency in ms of [(latency, ok)].'''
+
+    ordered = sorted(latency for latency, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'rps': round(len(samples) / seconds, 1) if seconds else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1e3, 3),
+        'p50_ms': round(percentile(ordered, 50) * 1e3, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1e3, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1e3, 3),
+    }
+
+
+class StubUser:
+    '''authomatic result.user of the stub provider.'''
+
+    def __init__(self, email):
+
+        self.email = email
+        self.name = email.split('@')[0]
+
+    def update(self):
+
+        pass
+
+
+class StubResult:
+
+    def __init__(self, email):
+
+        self.user = StubUser(email)
+        self.error = None
+
+
+def stub_social_login(emails):
+    '''Replace SocialLogin with a provider that logs in at once.'''
+
+    from flask import make_response
+    import src.login.routes as routes
+
+    class StubSocialLogin:
+
+        def __init__(self, provider):
+
+            self.provider = provider
+
+        def login(self, request):
+
+            return make_response(), StubResult(next(emails))
+
+    routes.SocialLogin = StubSocialLogin
+
+
+class Bench:
+    '''Seeded app plus the scenarios run against it.'''
+
+    def __init__(self, app, args):
+
+        self.app = app
+        self.args = args
+        self.results = {}
+        self.signups = []
+        self._ids = count()
+
+    def seed(self):
+        '''Insert --users confirmed users through CreateUser.'''
+
+        from src import db, hasher
+        from src.models import CreateUser
+
+        # One real hash, reused, so seeding does not take N hash times.
+        pwhash = hasher.generate(PASSWORD)
+        generate, hasher.generate = hasher.generate, lambda password: pwhash
+        try:
+            with self.app.test_request_context():
+                for i in range(self.args.users):
+                    user = CreateUser(self.email('user', i)).create(
+                        name='User {}'.format(i),
+                        login_type='site',
+                        password=PASSWORD,
+                        commit=False
+                    )
+                    user.confirmed = True
+                    if i % 500 == 499:
+                        db.session.commit()
+                db.session.commit()
+        finally:
+            hasher.generate = generate
+
+    @staticmethod
+    def email(kind, i):
+
+        return '{}-{}@bench.example.com'.format(kind, i)
+
+    def next_id(self):
+
+        return next(self._ids)
+
+    def user_email(self):
+
+        return self.email('user', self.next_id() % self.args.users)
+
+    def client(self):
+
+        return self.app.test_client()
+
+    def login(self, client, email):
+
+        return client.post('/login/', data={
+            'email': email, 'password': PASSWORD})
+
+    def run(self, name, setup, request):
+        '''
+        Time --requests calls of request(client, state).
+
+        setup(client) -> state runs untimed, once per simulated browser.
+        '''
+
+        args = self.args
+        per_client = max(args.requests // args.concurrency, 1)
+
+        def browse(_):
+            client = self.client()
+            state = setup(client) if setup else None
+            samples = []
+            for _ in range(per_client):
+                start = perf_counter()
+                response = request(client, state)
+                samples.append((
+                    perf_counter() - start, response.status_code < 400))
+            return samples
+
+        start = perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            samples = [s for chunk in pool.map(
+                browse, range(args.concurrency)) for s in chunk]
+        self.results[name] = summarize(samples, perf_counter() - start)
+
+    def scenarios(self):
+
+        from src.login.models import UserToken
+
+        def signup(client, state):
+            i = self.next_id()
+            email = self.email('signup', i)
+            self.signups.append(email)
+            return client.post('/signup', data={
+                'name': 'Signup {}'.format(i),
+                'email': email,
+                'password': PASSWORD,
+                'confirm': PASSWORD
+            })
+
+        def confirm(client, state):
+            email = self.signups.pop()
+            with self.app.app_context():
+                token = UserToken.create(email, 'confirm')
+            if isinstance(token, bytes):
+                token = token.decode()
+            client.cookie_jar.clear()
+            return client.get('/confirm/' + token)
+
+        def login(client, state):
+            client.cookie_jar.clear()
+            return self.login(client, self.user_email())
+
+        def logged_in(client):
+            self.login(client, self.user_email())
+
+        def main(client, state):
+            return client.get('/')
+
+        def profile(client, state):
+            return client.get('/profile')
+
+        def reset(client, state):
+            return client.post('/reset', data={'email': self.user_email()})
+
+        def social(client, state):
+            client.cookie_jar.clear()
+            return client.get('/login/stub')
+
+        self.run('GET /login/', None, lambda c, s: c.get('/login/'))
+        self.run('GET /signup', None, lambda c, s: c.get('/signup'))
+        self.run('POST /signup', None, signup)
+        self.run('GET /confirm/<token>', None, confirm)
+        self.run('POST /login/', None, login)
+        self.run('GET /', logged_in, main)
+        self.run('GET /profile', logged_in, profile)
+        self.run('POST /reset', None, reset)
+        self.run('GET /login/<provider>', None, social)
+
+    def micro(self):
+        '''Per-call cost of the hot paths, in microseconds.'''
+
+        from flask import render_template
+        from src import render_cache
+        from src.login.forms import LoginForm
+        from src.login.models import UserToken
+        from src.models import User
+
+        n = self.args.micro
+        results = {}
+
+        def timeit(name, fn, iterations=n):
+            fn()
+            start = perf_counter()
+            for _ in range(iterations):
+                fn()
+            results[name] = {
+                'iterations': iterations,
+                'us_per_op': round(
+                    (perf_counter() - start) / iterations * 1e6, 2)
+            }
+
+        with self.app.test_request_context('/login/'):
+            user = User.query.filter_by(
+                email_key=User.normalize(self.email('user', 0))).one()
+            token = UserToken.create(user.email, 'confirm')
+            expired = UserToken.create(user.email, 'confirm', expires=-60)
+            form = LoginForm()
+            context = {'title': 'Log in.', 'template': 'login-page'}
+
+            timeit('check_password', lambda: user.check_password(PASSWORD),
+                   max(n // 10, 1))
+            timeit('UserToken.create', lambda: UserToken.create(
+                user.email, 'confirm'))
+            timeit('UserToken.verify', lambda: UserToken.verify(
+                token, 'confirm'))
+
+            # One fresh token per spend, the spent ones then replay.
+            links = [UserToken.create(user.email, 'confirm')
+                     for _ in range(n + 1)]
+            spend = iter(links)
+            timeit('UserToken.verify spend', lambda: UserToken.verify(
+                next(spend), 'confirm', spend=True))
+            timeit('UserToken.verify replayed', lambda: UserToken.verify(
+                links[0], 'confirm', spend=True))
+            timeit('UserToken.verify expired', lambda: UserToken.verify(
+                expired, 'confirm'))
+            timeit('render_template login.jinja2', lambda: render_template(
+                'login.jinja2', form=form, **context))
+            timeit('render_cache login.jinja2', lambda: render_cache.render(
+                'login.jinja2', form, **context))
+
+        self.results['micro'] = results
+
+    def mail_queued(self):
+
+        from src.mailer.outbox import OutboxMail
+
+        with self.app.app_context():
+            return OutboxMail.query.count()
+
+
+def main():
+
+    args = parse_args()
+    configure(args)
+    cold = cold_start(args)
+    imports = import_times()
+
+    from server import app
+    from src.login.recorder import recorder
+    from src.schema import migrations
+
+    with app.app_context():
+        migrations.upgrade()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    stub_social_login(
+        Bench.email('social', i) for i in count())
+
+    bench = Bench(app, args)
+    start = perf_counter()
+    bench.seed()
+    seed_seconds = perf_counter() - start
+
+    bench.scenarios()
+    bench.micro()
+    recorder.flush()
+
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': args.database.split(':', 1)[0],
+        'users': args.users,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'hash_iterations': app.config['HASH_ITERATIONS'],
+        'seed_seconds': round(seed_seconds, 3),
+        'cold_start': cold,
+        'import_ms': imports,
+        'mail_queued': bench.mail_queued(),
+        'routes': {k: v for k, v in bench.results.items() if k != 'micro'},
+        'micro': bench.results['micro'],
+    }
+
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), 'results',
+        '{}.json'.format((commit or 'local')[:12]))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('{:<24} {:>6} {:>5} {:>9} {:>9} {:>9} {:>9}'.format(
+        'route', 'reqs', 'errs', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, r in report['routes'].items():
+        print('{:<24} {:>6} {:>5} {:>9} {:>9} {:>9} {:>9}'.format(
+            name, r['requests'], r['errors'], r['rps'],
+            r['p50_ms'], r['p95_ms'], r['p99_ms']))
+    for name, r in report['micro'].items():
+        print('{:<32} {:>12} us/op'.format(name, r['us_per_op']))
+    for name, value in report['cold_start'].items():
+        print('cold start {:<21} {:>12}'.format(name, value))
+    for name, ms in report['import_ms'].items():
+        print('import {:<25} {:>12} ms'.format(name, ms))
+    print('results: {}'.format(output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
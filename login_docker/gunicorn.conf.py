@@ -0,0 +1,100 @@
+'''
+Gunicorn production profile.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+Every setting can be overridden from the environment (GUNICORN_*).
+GUNICORN_WORKER_CLASS selects 'gthread' (default), 'gevent' or 'sync'.
+gevent suits slow OAuth callbacks and SMTP handshakes; it patches the
+stdlib here, before the app is preloaded, and moves password hashing
+to a process pool so a hash never blocks the event loop.
+
+The app is preloaded in the master and shared copy-on-write; each
+worker then drops the database connections it inherited. Workers are
+recycled after GUNICORN_MAX_REQUESTS requests and, on shutdown, drain
+queued mail and buffered logins before exiting.
+'''
+
+import os
+from multiprocessing import cpu_count
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+    os.environ.setdefault('HASH_POOL', 'process')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Per worker: DB_POOL_SIZE + DB_MAX_OVERFLOW connections, keep
+# workers * that below Postgres max_connections.
+workers = int(os.environ.get('GUNICORN_WORKERS', cpu_count() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() in (
+    '1', 'true', 'yes')
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Longer than the idle timeout of the nginx upstream keepalive pool.
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 75))
+
+# Heartbeat files in memory, not on the container's overlay fs.
+worker_tmp_dir = os.environ.get('GUNICORN_WORKER_TMP_DIR', '/dev/shm')
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG')
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def on_starting(server):
+    '''Drop metrics snapshots of a previous run.'''
+
+    from src.config import Config
+    from src.metrics import metrics
+
+    metrics.directory = metrics.directory or Config.METRICS_DIR
+    metrics.clear()
+
+
+def post_fork(server, worker):
+    '''Do not share the master's database connections with the worker.'''
+
+    if not server.cfg.preload_app:
+        return
+
+    from src import db
+
+    app = server.app.wsgi()
+    with app.app_context():
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        for bind in [None] + list(binds):
+            db.get_engine(app, bind).dispose()
+
+
+def worker_exit(server, worker):
+    '''Drain write-behind buffers before the worker goes away.'''
+
+    from src.login.recorder import recorder
+    from src.logs import logs
+    from src.mailer.outbox import outbox
+    from src.metrics import metrics
+    from src.sweeper import sweeper
+
+    sweeper.stop()
+    outbox.stop(drain=True, timeout=graceful_timeout / 2)
+    recorder.stop()
+    metrics.stop()
+    logs.stop()
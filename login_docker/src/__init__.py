@@ -1,11 +1,29 @@
 """Initialize app."""
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from src.assets import Assets
+from src.database import DatabasePool
+from src.logs import logs
+from src.metrics import metrics
+from src.queries import queries
+from src.replicas import ReplicaRouter, RoutingSQLAlchemy
+from src.login.cache import UserCache
+from src.login.hashing import HashService
+from src.login.render_cache import RenderCache
+from src.store import SharedStore
 
-db = SQLAlchemy()
+
+db = RoutingSQLAlchemy()
+replicas = ReplicaRouter()
+db_pool = DatabasePool()
 login_manager = LoginManager()
+user_cache = UserCache()
+hasher = HashService()
+assets = Assets()
+render_cache = RenderCache()
+store = SharedStore()
 
 
 def create_app():
@@ -13,19 +31,55 @@ def create_app():
 
     app = Flask(__name__, instance_relative_config=False)
     app.config.from_object('src.config.Config')
+    app.config.from_object('src.config.MailerConfig')
+
+    # Client addresses as seen by nginx.
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
     # Initialize plugins.
+    logs.init_app(app)
+    metrics.init_app(app)
+    queries.init_app(app)
+    db_pool.init_app(app)
+    replicas.init_app(app, db)
     db.init_app(app)
     login_manager.init_app(app)
+    user_cache.init_app(app)
+    hasher.init_app(app)
+    assets.init_app(app)
+    render_cache.init_app(app)
+    store.init_app(app)
 
     with app.app_context():
         import src.routes as routes
         import src.login.routes as login
+        from src.mailer.outbox import outbox
+        from src.login.throttle import throttle
+        from src.login.recorder import recorder
+        from src.login.social import social
+        from src.login.tokens import tokens
+        from src.schema import migrations
+        from src.transfer import transfer
+        from src.sweeper import sweeper
+        from src.health import health_bp
+        from src.admin import admin_bp
+
+        outbox.init_app(app)
+        throttle.init_app(app)
+        recorder.init_app(app)
+        social.init_app(app)
+        tokens.init_app(app)
+        migrations.init_app(app)
+        transfer.init_app(app)
+        sweeper.init_app(app)
 
         # Register routes.
         app.register_blueprint(routes.main_bp)
         app.register_blueprint(login.auth_bp)
+        app.register_blueprint(health_bp)
+        app.register_blueprint(admin_bp)
 
-        db.create_all()
-
+        # The schema is migrated before the workers start, see src/schema.py.
         return app
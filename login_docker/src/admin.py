@@ -0,0 +1,208 @@
+'''
+Read-only admin API.
+[users]
+
+    GET /admin/api/users?email=ann&confirmed=false&limit=100
+    Authorization: Bearer $ADMIN_API_TOKEN
+
+Filters: email (prefix), login_type, confirmed, created_from/_to and
+last_login_from/_to (ISO dates). Results are ordered by `sort` (id,
+email, created or last_login; by default the column filtered on) and
+paged with the opaque `next` cursor of the previous page, a keyset on
+(sort column, id), so any page costs one index range scan. Only the
+listed columns are read, on a replica when there is one. The API is
+off while ADMIN_API_TOKEN is unset.
+'''
+
+import base64
+import datetime
+import hmac
+import json
+
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import and_, select, tuple_
+from werkzeug.exceptions import (
+    BadRequest, HTTPException, NotFound, Unauthorized)
+
+from src import db, replicas
+from src.models import User
+from src.queries import query_budget
+
+
+admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin/api')
+
+COLUMNS = (
+    'id', 'email', 'name', 'login_type', 'confirmed', 'created', 'last_login'
+)
+
+# Each backed by an index on (column, id), see schema.py.
+SORTS = ('id', 'email', 'created', 'last_login')
+
+
+@admin_bp.before_request
+def authorize():
+    '''Bearer ADMIN_API_TOKEN, the blueprint is hidden without one.'''
+
+    token = current_app.config['ADMIN_API_TOKEN']
+    if not token:
+        raise NotFound()
+
+    auth = request.headers.get('Authorization', '')
+    if not (auth.startswith('Bearer ') and hmac.compare_digest(
+            auth[len('Bearer '):].encode(), token.encode())):
+        raise Unauthorized()
+
+
+@admin_bp.errorhandler(HTTPException)
+def error(e):
+
+    return jsonify({'error': e.description}), e.code
+
+
+def parse_date(name: str):
+
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequest('{} is not an ISO date.'.format(name))
+
+
+def sort_column(sort: str):
+    '''Column expression of a sort key, bytewise for email on Postgres.'''
+
+    column = User.__table__.c['email_key' if sort == 'email' else sort]
+    if sort == 'email' and db.engine.dialect.name == 'postgresql':
+        # Matches ix_users_email_key_c, usable for prefix ranges.
+        return column.collate('C')
+    return column
+
+
+def encode_cursor(sort: str, row):
+
+    value = row['email_key' if sort == 'email' else sort]
+    if value is None and sort != 'id':
+        raise ValueError('Cannot page from a NULL {}.'.format(sort))
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str):
+    '''(sort value, id) of a cursor made for the same sort.'''
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, last_id = json.loads(raw)
+        if sort in ('created', 'last_login'):
+            # Rows without a date are never paged by it, see users().
+            if value is None:
+                raise ValueError('No date.')
+            value = datetime.datetime.fromisoformat(value)
+        last_id = int(last_id)
+    except (ValueError, TypeError):
+        raise BadRequest('Invalid cursor.')
+
+    if cursor_sort != sort:
+        raise BadRequest('The cursor belongs to another sort.')
+    return value, last_id
+
+
+def project(row):
+
+    user = {c: row[c] for c in COLUMNS}
+    for name in ('created', 'last_login'):
+        if user[name] is not None:
+            user[name] = user[name].isoformat()
+    return user
+
+
+def default_sort(args):
+    '''The column a range filter is on, or id.'''
+
+    if User.normalize(args.get('email') or ''):
+        return 'email'
+    if args.get('created_from') or args.get('created_to'):
+        return 'created'
+    if args.get('last_login_from') or args.get('last_login_to'):
+        return 'last_login'
+    return 'id'
+
+
+def prefix_range(column, prefix: str):
+    '''column starts with prefix, as a range an index can scan.'''
+
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(column >= prefix, column < upper)
+
+
+@admin_bp.route('/users', methods=['GET'])
+@query_budget(SELECT=1, INSERT=0, UPDATE=0, DELETE=0)
+def users():
+    '''[GET] One page of users matching the filters, JSON.'''
+
+    args = request.args
+    table = User.__table__
+
+    sort = args.get('sort') or default_sort(args)
+    if sort not in SORTS:
+        raise BadRequest('sort is one of {}.'.format(', '.join(SORTS)))
+
+    try:
+        limit = int(args.get('limit', current_app.config['ADMIN_PAGE_SIZE']))
+    except ValueError:
+        raise BadRequest('limit is a number.')
+    limit = max(1, min(limit, current_app.config['ADMIN_MAX_PAGE_SIZE']))
+
+    where = []
+    prefix = User.normalize(args.get('email') or '')
+    if prefix:  # Blank once normalized, e.g. email=%20: no filter.
+        where.append(prefix_range(sort_column('email'), prefix))
+    if args.get('login_type'):
+        where.append(table.c.login_type == args['login_type'])
+    if args.get('confirmed'):
+        confirmed = args['confirmed'].lower() in ('1', 'true', 'yes')
+        where.append(table.c.confirmed == confirmed)
+
+    for name in ('created', 'last_login'):
+        start = parse_date('{}_from'.format(name))
+        end = parse_date('{}_to'.format(name))
+        if start is not None:
+            where.append(table.c[name] >= start)
+        if end is not None:
+            where.append(table.c[name] < end)
+    if sort in ('created', 'last_login'):
+        # NULL dates have no place in the keyset order.
+        where.append(table.c[sort].isnot(None))
+
+    column = sort_column(sort)
+    if args.get('after'):
+        value, last_id = decode_cursor(args['after'], sort)
+        if sort == 'id':
+            where.append(table.c.id > last_id)
+        elif sort == 'email':  # Unique already.
+            where.append(column > value)
+        else:
+            where.append(tuple_(column, table.c.id) > tuple_(value, last_id))
+
+    projection = [table.c[c] for c in COLUMNS]
+    if sort == 'email':
+        projection.append(table.c.email_key)
+
+    order = [column] if sort in ('id', 'email') else [column, table.c.id]
+    query = select(projection).order_by(*order).limit(limit + 1)
+    for clause in where:
+        query = query.where(clause)
+
+    with replicas.reading():
+        rows = db.session.execute(query).fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'users': [project(row) for row in rows],
+        'next': encode_cursor(sort, rows[-1]) if more else None
+    })
@@ -0,0 +1,124 @@
+'''
+Static asset pipeline.
+
+`flask assets build` (or `python -m src.assets`) writes every file of
+static/dist to static/build under a content-hashed name, with gzip and
+brotli variants, and a manifest.json that url_for() in templates
+resolves 'static' filenames against. The committed dist files are what
+the site ships, they are fingerprinted byte for byte, never rebuilt.
+nginx serves static/build directly.
+'''
+
+import gzip
+import hashlib
+import json
+import os
+
+import click
+from flask import url_for
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_FOLDER = os.path.join(os.path.dirname(__file__), 'static')
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json')
+
+
+def write(path: str, data: bytes):
+    '''Write a file and its precompressed variants.'''
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    if not path.endswith(COMPRESSIBLE):
+        return
+
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+
+
+def build(static_folder: str = STATIC_FOLDER):
+    '''Build static/build and return the manifest.'''
+
+    manifest = {}
+    dist = os.path.join(static_folder, 'dist')
+    for root, _, files in os.walk(dist):
+        for name in sorted(files):
+            filename = os.path.relpath(
+                os.path.join(root, name), static_folder).replace(os.sep, '/')
+
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(filename)
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = '{}/{}.{}{}'.format(BUILD_DIR, stem, digest, ext)
+
+            write(os.path.join(static_folder, hashed), data)
+            manifest[filename] = hashed
+
+    path = os.path.join(static_folder, BUILD_DIR, MANIFEST)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class Assets:
+    '''Resolve static filenames against the build manifest.'''
+
+    def __init__(self, app=None):
+
+        self.manifest = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        app.cli.add_command(assets_cli)
+        app.extensions['assets'] = self
+
+        path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+        if not os.path.exists(path):
+            # Not built (development), Flask serves static/dist.
+            return
+
+        with open(path) as f:
+            self.manifest = json.load(f)
+        app.jinja_env.globals['url_for'] = self.url_for
+
+    def url_for(self, endpoint: str, **values):
+        '''url_for() with built static filenames.'''
+
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(
+                values['filename'], values['filename'])
+
+        return url_for(endpoint, **values)
+
+
+assets_cli = AppGroup('assets', help='Static asset commands.')
+
+
+@assets_cli.command('build')
+def build_command():
+    '''Build fingerprinted, precompressed static files.'''
+
+    manifest = build()
+    click.echo('Built {} static files.'.format(len(manifest)))
+
+
+if __name__ == '__main__':
+    build_command.callback()
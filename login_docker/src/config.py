@@ -2,12 +2,18 @@
 from os import environ, path
 from dotenv import load_dotenv
 
-from authomatic.providers import oauth2
+from src.login.hashing import DEFAULT_ITERATIONS
 
 basedir = path.abspath(path.dirname(__file__))
 load_dotenv(path.join(basedir, '.env'))
 
 
+def env_flag(name: str, default: str = 'False'):
+    '''Boolean setting from the environment.'''
+
+    return environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
 class Config:
     '''Set Flask configuration.'''
 
@@ -20,6 +26,110 @@ class Config:
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Postgres pool per worker, see src/database.py. Statement timeout in
+    # ms, 0 = none. DB_PGBOUNCER targets PgBouncer in transaction mode.
+    DB_POOL_SIZE = int(environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = float(environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', 'True')
+    DB_STATEMENT_TIMEOUT = int(environ.get('DB_STATEMENT_TIMEOUT', 10000))
+    DB_PGBOUNCER = env_flag('DB_PGBOUNCER')
+
+    # Comma separated read replicas for user lookups, see src/replicas.py.
+    SQLALCHEMY_REPLICA_URIS = [
+        uri for uri in environ.get('SQLALCHEMY_REPLICA_URIS', '').split(',')
+        if uri.strip()
+    ]
+    REPLICA_PIN_SECONDS = int(environ.get('REPLICA_PIN_SECONDS', 5))
+
+    # Per-worker user cache for the login manager.
+    USER_CACHE_SIZE = int(environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(environ.get('USER_CACHE_TTL', 60))
+
+    # Password hashing pool ('thread' or 'process'), 0 workers = CPU count.
+    HASH_POOL = environ.get('HASH_POOL', 'thread')
+    HASH_WORKERS = int(environ.get('HASH_WORKERS', 0))
+    HASH_QUEUE_DEPTH = int(environ.get('HASH_QUEUE_DEPTH', 32))
+    HASH_ITERATIONS = int(environ.get('HASH_ITERATIONS', DEFAULT_ITERATIONS))
+
+    # Serve current_user from signed session claims instead of the DB.
+    SESSION_CLAIMS = env_flag('SESSION_CLAIMS')
+    SESSION_CLAIMS_TTL = int(environ.get('SESSION_CLAIMS_TTL', 300))
+
+    # Seconds nginx may cache a positive /auth/verify result.
+    AUTH_VERIFY_CACHE_TTL = int(environ.get('AUTH_VERIFY_CACHE_TTL', 5))
+
+    # Cache anonymous GET renders of the auth pages.
+    RENDER_CACHE = env_flag('RENDER_CACHE', 'True')
+
+    # Number of proxies (nginx) setting X-Forwarded-For in front of the app.
+    # 0 trusts no X-Forwarded-For: without a proxy any client could set
+    # it and pass the per-IP throttles. docker-compose.yml sets 1.
+    PROXY_FIX_X_FOR = int(environ.get('PROXY_FIX_X_FOR', 0))
+
+    # Counters shared by the workers, see src/store.py.
+    SHARED_STORE = environ.get(
+        'SHARED_STORE', 'sqlite:////tmp/auth-shared-store.db')
+    SHARED_STORE_CLASS = environ.get('SHARED_STORE_CLASS')
+
+    # Confirm and recover link tokens, see src/login/tokens.py.
+    TOKEN_KEYS = environ.get('TOKEN_KEYS')
+    TOKEN_TTL = int(environ.get('TOKEN_TTL', 600))
+    # Bearer tokens of POST /auth/token, revoked with the user's sessions.
+    ACCESS_TOKEN_TTL = int(environ.get('ACCESS_TOKEN_TTL', 3600))
+
+    # Auth form throttling, 'count/seconds' per client IP and email.
+    THROTTLE = env_flag('THROTTLE', 'True')
+    THROTTLE_LOGIN_IP = environ.get('THROTTLE_LOGIN_IP', '30/60')
+    THROTTLE_LOGIN_EMAIL = environ.get('THROTTLE_LOGIN_EMAIL', '10/300')
+    THROTTLE_RESET_IP = environ.get('THROTTLE_RESET_IP', '10/300')
+    THROTTLE_RESET_EMAIL = environ.get('THROTTLE_RESET_EMAIL', '3/900')
+    THROTTLE_SIGNUP_IP = environ.get('THROTTLE_SIGNUP_IP', '10/300')
+
+    # Write-behind last_login and login_events flushing.
+    LOGIN_FLUSH_INTERVAL = float(environ.get('LOGIN_FLUSH_INTERVAL', 5))
+    LOGIN_FLUSH_SIZE = int(environ.get('LOGIN_FLUSH_SIZE', 500))
+
+    # Expired state sweeping, see src/sweeper.py. 'off' when
+    # `flask sweep run` runs separately.
+    SWEEPER = environ.get('SWEEPER', 'thread')
+    SWEEP_INTERVAL = float(environ.get('SWEEP_INTERVAL', 3600))
+    SWEEP_BATCH_SIZE = int(environ.get('SWEEP_BATCH_SIZE', 500))
+    SWEEP_PAUSE = float(environ.get('SWEEP_PAUSE', .5))
+    SWEEP_UNCONFIRMED_DAYS = float(environ.get('SWEEP_UNCONFIRMED_DAYS', 7))
+
+    # Read-only admin API, off without a token, see src/admin.py.
+    ADMIN_API_TOKEN = environ.get('ADMIN_API_TOKEN')
+    ADMIN_PAGE_SIZE = int(environ.get('ADMIN_PAGE_SIZE', 50))
+    ADMIN_MAX_PAGE_SIZE = int(environ.get('ADMIN_MAX_PAGE_SIZE', 500))
+
+    # Social provider HTTP calls, see src/login/social.py.
+    SOCIAL_HTTP_TIMEOUT = float(environ.get('SOCIAL_HTTP_TIMEOUT', 5))
+    SOCIAL_POOL_SIZE = int(environ.get('SOCIAL_POOL_SIZE', 4))
+    SOCIAL_MAX_CONCURRENT = int(environ.get('SOCIAL_MAX_CONCURRENT', 8))
+    SOCIAL_BREAKER_FAILURES = int(environ.get('SOCIAL_BREAKER_FAILURES', 5))
+    SOCIAL_BREAKER_RESET = float(environ.get('SOCIAL_BREAKER_RESET', 30))
+
+    # Logging, see src/logs.py. LOG_LEVELS: 'module=LEVEL,...'.
+    LOG_FORMAT = environ.get('LOG_FORMAT', 'json')
+    LOG_LEVEL = environ.get('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = environ.get('LOG_LEVELS')
+    LOG_QUEUE_SIZE = int(environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_SAMPLE_BURST = int(environ.get('LOG_SAMPLE_BURST', 20))
+    LOG_SLOW_REQUEST_MS = float(environ.get('LOG_SLOW_REQUEST_MS', 1000))
+    LOG_REQUESTS = env_flag('LOG_REQUESTS')
+
+    # Metrics, each worker snapshots to METRICS_DIR for /metrics.
+    METRICS = env_flag('METRICS', 'True')
+    METRICS_DIR = environ.get('METRICS_DIR', '/tmp/auth-metrics')
+    METRICS_FLUSH_INTERVAL = float(environ.get('METRICS_FLUSH_INTERVAL', 10))
+
+    # Query counts in X-Query-* headers (always on in debug mode) and
+    # @query_budget enforcement (always on when testing).
+    QUERY_HEADERS = env_flag('QUERY_HEADERS')
+    QUERY_BUDGETS = env_flag('QUERY_BUDGETS')
+
     # Flask-Assets
     LESS_BIN = environ.get('LESS_BIN')
     ASSETS_DEBUG = environ.get('ASSETS_DEBUG')
@@ -41,14 +151,27 @@ class MailerConfig:
     MAIL_PASSWORD = environ.get('MAIL_PASSWORD')
     SENDER = environ.get('SENDER')
 
+    # Outbox dispatcher, 'off' when `flask mail dispatch` runs separately.
+    MAIL_DISPATCHER = environ.get('MAIL_DISPATCHER', 'thread')
+    MAIL_BATCH_SIZE = int(environ.get('MAIL_BATCH_SIZE', 50))
+    MAIL_POLL_INTERVAL = float(environ.get('MAIL_POLL_INTERVAL', 5))
+    MAIL_IDLE_TIMEOUT = float(environ.get('MAIL_IDLE_TIMEOUT', 60))
+    MAIL_MAX_ATTEMPTS = int(environ.get('MAIL_MAX_ATTEMPTS', 8))
+    MAIL_RETRY_BACKOFF = float(environ.get('MAIL_RETRY_BACKOFF', 30))
+
 
 class SocialConfig:
-    ''' Set social media config.'''
+    '''
+    Set social media config.
+
+    Provider classes are import paths, authomatic is only imported when
+    a social login is first used.
+    '''
 
     SECRET_KEY = environ.get('SECRET_KEY')
     CONFIG = {
         'fb': {
-            'class_': oauth2.Facebook,
+            'class_': 'authomatic.providers.oauth2.Facebook',
             'consumer_key': environ.get('FB_CONSUMER_KEY'),
             'consumer_secret': environ.get('FB_CONSUMER_SECRET'),
             'scope': ['email']
@@ -0,0 +1,79 @@
+'''
+Connection pool settings of the SQLAlchemy engines.
+
+Each gunicorn worker has its own pool, so DB_POOL_SIZE + DB_MAX_OVERFLOW
+times the number of workers must stay below Postgres max_connections.
+Connections are pre-pinged and recycled, so a Postgres restart costs a
+reconnect instead of failed requests.
+
+With DB_PGBOUNCER the app targets a PgBouncer in transaction mode:
+PgBouncer does the pooling (NullPool here), no startup options are sent
+and the statement timeout is set per transaction with SET LOCAL, so no
+state outlives a transaction on the shared server connection.
+'''
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+
+class DatabasePool:
+    '''Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings.'''
+
+    def __init__(self, app=None):
+
+        self.statement_timeout = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        config = app.config
+        uri = config.get('SQLALCHEMY_DATABASE_URI') or 'sqlite://'
+        backend = make_url(uri).get_backend_name()
+        app.extensions['db_pool'] = self
+
+        # SQLite is a file, there is nothing to pool or time out.
+        if backend != 'postgresql':
+            return
+
+        options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+        self.statement_timeout = config['DB_STATEMENT_TIMEOUT']
+
+        if config['DB_PGBOUNCER']:
+            options['poolclass'] = NullPool
+            if self.statement_timeout and not event.contains(
+                    Engine, 'begin', self.set_local_timeout):
+                event.listen(Engine, 'begin', self.set_local_timeout)
+        else:
+            options.update(
+                pool_size=config['DB_POOL_SIZE'],
+                max_overflow=config['DB_MAX_OVERFLOW'],
+                pool_timeout=config['DB_POOL_TIMEOUT'],
+                pool_recycle=config['DB_POOL_RECYCLE']
+            )
+            if self.statement_timeout:
+                options['connect_args'] = {
+                    'options': '-c statement_timeout={}'.format(
+                        self.statement_timeout)
+                }
+
+        # Explicit SQLALCHEMY_ENGINE_OPTIONS win over the DB_* settings.
+        options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    def set_local_timeout(self, conn):
+        '''Statement timeout of the transaction conn is beginning.'''
+
+        if conn.dialect.name != 'postgresql':
+            return
+
+        # On the DBAPI cursor, so it is not counted as a query.
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(
+                'SET LOCAL statement_timeout = %s', (self.statement_timeout,))
+        finally:
+            cursor.close()
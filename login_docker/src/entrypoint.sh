@@ -1,14 +1,11 @@
 #!/bin/sh
+set -e
 
-if [ "$DATABASE" = "postgres" ]
-then
-    echo "Waiting for postgres..."
+# Wait for the database, then migrate it once before the workers start.
+flask schema wait --timeout 60
+flask schema upgrade
 
-    while ! nc -z $SQL_HOST $SQL_PORT; do
-      sleep 0.1
-    done
-
-    echo "PostgreSQL started"
-fi
+# Fingerprinted static files, served by nginx from the shared volume.
+python -m src.assets
 
 exec "$@"
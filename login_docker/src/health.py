@@ -0,0 +1,51 @@
+'''
+Liveness and readiness probes.
+[healthz, readyz]
+'''
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+
+from src import db
+from src.mailer.outbox import outbox
+from src.schema import migrations
+
+
+health_bp = Blueprint('health_bp', __name__)
+
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    '''[GET] 200 while the worker serves requests, nothing is checked.'''
+
+    return 'ok', 200, {'Content-Type': 'text/plain'}
+
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    '''
+    [GET] 200 when the worker can serve traffic, 503 otherwise.
+
+    Checks a pooled database connection, that the schema is migrated
+    and that the mail dispatcher of this worker is running.
+    '''
+
+    checks = {}
+
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        checks['database'] = 'ok'
+        checks['schema'] = 'ok' if migrations.is_current() else 'pending'
+    except Exception as e:
+        checks['database'] = 'error: {}'.format(type(e).__name__)
+        checks['schema'] = 'unknown'
+
+    if current_app.config['MAIL_DISPATCHER'] == 'thread':
+        running = outbox.dispatcher is not None and outbox.dispatcher.is_alive()
+        checks['mail'] = 'ok' if running else 'stopped'
+    else:
+        checks['mail'] = 'external'
+
+    ready = all(v in ('ok', 'external') for v in checks.values())
+    return jsonify(checks), 200 if ready else 503
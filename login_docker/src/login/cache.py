@@ -0,0 +1,99 @@
+'''Per-worker user cache used by the login manager.'''
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from src.metrics import metrics
+
+
+class UserCache:
+    '''
+    Bounded LRU cache of detached User rows with a TTL.
+
+    Each gunicorn worker has its own copy, so entries are invalidated
+    explicitly by the routes that change a user and otherwise expire
+    after USER_CACHE_TTL seconds.
+    '''
+
+    def __init__(self, app=None):
+
+        self.size = 10000
+        self.ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.size = app.config.get('USER_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        app.extensions['user_cache'] = self
+        metrics.worker_collector(self.collect)
+
+    def get(self, user_id):
+        '''Cached user or None.'''
+
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, user):
+        '''Cache a detached user.'''
+
+        if self.size <= 0:
+            return
+
+        key = str(user_id)
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        '''Drop a user after its row changed.'''
+
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+    def collect(self):
+        '''Samples for the metrics endpoint.'''
+
+        stats = self.stats()
+        return [
+            ('user_cache_hits_total', 'counter',
+             'User loader cache hits.', stats['hits']),
+            ('user_cache_misses_total', 'counter',
+             'User loader cache misses.', stats['misses']),
+            ('user_cache_size', 'gauge',
+             'Users in the user loader cache.', stats['size']),
+        ]
+
+    def stats(self):
+        '''Hit/miss counters for this worker.'''
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
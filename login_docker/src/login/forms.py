@@ -72,16 +72,8 @@ class ResetForm(FlaskForm):
 
 
 class RecoverForm(FlaskForm):
-    ''' User set net password form. '''
+    ''' User set net password form, for the email of the link token. '''
 
-    email = StringField(
-        'Email',
-        validators=[
-            Length(min=6),
-            Email(message='Enter a valid email.'),
-            DataRequired()
-        ]
-    )
     password = PasswordField(
         'Password',
         validators=[
@@ -0,0 +1,104 @@
+'''Password hashing off the request thread.'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from src.metrics import HASH_SECONDS
+
+
+# PBKDF2 cost when HASH_ITERATIONS is unset, the Config default too.
+DEFAULT_ITERATIONS = 260000
+
+
+class HashQueueFull(ServiceUnavailable):
+    '''Every hashing slot is taken, reject instead of queueing.'''
+
+    description = 'The server is busy, please try again in a moment.'
+
+
+class HashService:
+    '''
+    Bounded worker pool for password hashing.
+
+    HASH_POOL selects a 'thread' or 'process' pool of HASH_WORKERS
+    workers. At most HASH_QUEUE_DEPTH hashes wait behind the running
+    ones; anything beyond that raises HashQueueFull (503). The cost is
+    set per deployment with HASH_ITERATIONS.
+    '''
+
+    def __init__(self, app=None):
+
+        self.pool = 'thread'
+        self.workers = os.cpu_count() or 1
+        self.queue_depth = 32
+        self.method = 'pbkdf2:sha256:{}'.format(DEFAULT_ITERATIONS)
+        self._executor = None
+        self._pid = None
+        self._slots = BoundedSemaphore(self.workers + self.queue_depth)
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.pool = app.config.get('HASH_POOL', self.pool)
+        self.workers = app.config.get('HASH_WORKERS') or self.workers
+        self.queue_depth = app.config.get('HASH_QUEUE_DEPTH', self.queue_depth)
+        self.method = 'pbkdf2:sha256:{}'.format(
+            app.config.get('HASH_ITERATIONS', DEFAULT_ITERATIONS))
+        self._slots = BoundedSemaphore(self.workers + self.queue_depth)
+        app.extensions['hasher'] = self
+
+    def get_executor(self):
+        '''Pool of the current process, created after the worker fork.'''
+
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                if self.pool == 'process':
+                    self._executor = ProcessPoolExecutor(self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='hasher')
+                self._pid = os.getpid()
+
+            return self._executor
+
+    def run(self, fn, *args):
+        '''Run fn in the pool and wait for its result.'''
+
+        start = perf_counter()
+        if not self._slots.acquire(blocking=False):
+            raise HashQueueFull()
+
+        try:
+            future = self.get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result()
+        finally:
+            HASH_SECONDS.observe(perf_counter() - start, fn.__name__)
+
+    def generate(self, password: str):
+        '''Hash a password with the configured method and cost.'''
+
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash: str, password: str):
+        '''Validate a password against its hash.'''
+
+        return self.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str):
+        '''If a hash uses a legacy method (e.g. sha256) or another cost.'''
+
+        return pwhash.split('$', 1)[0] != self.method
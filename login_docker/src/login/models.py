@@ -1,67 +1,42 @@
-import os
-from time import time
-
-import jwt
-from authomatic.adapters import WerkzeugAdapter
-from authomatic import Authomatic
-from flask import make_response
-
-from src.config import SocialConfig
+from src.login.social import social
+from src.login.tokens import tokens
 
 
 class UserToken:
-    ''' Class to generate & validate user tokens. '''
+    ''' Class to generate & validate user tokens, see src/login/tokens.py. '''
 
     @staticmethod
-    def create(email: str, expires: int = 600):
-        '''Get token.'''
+    def create(email: str, purpose: str, expires: int = None):
+        '''Get token for 'access', 'confirm' or 'recover'.'''
 
-        return jwt.encode(
-            {
-                'email': email,
-                'exp': time() + expires
-            },
-            key=os.getenv('SECRET_KEY')
-        )
+        return tokens.create(email, purpose, expires)
 
     @staticmethod
-    def verify(token: str):
-        ''' Verify token.'''
+    def verify(token: str, purpose: str, spend: bool = False):
+        ''' Verify token of `purpose`, `spend` it to use it once.'''
 
-        try:
-            token = jwt.decode(token, key=os.getenv('SECRET_KEY'))
+        return tokens.verify(token, purpose, spend)
 
-            # Expired.
-            if token['exp'] < time():
-                return False
+    @staticmethod
+    def create_access(user):
+        '''Get bearer token of a user for /auth/verify.'''
 
-            email = token['email']
+        return tokens.create_access(user)
 
-        except Exception as e:
-            print(e)
-            return False
+    @staticmethod
+    def claims(token: str, purpose: str):
+        '''Verify token of `purpose`, get all its claims.'''
 
-        return email
+        return tokens.claims(token, purpose)
 
 
-class SocialLogin(SocialConfig):
+class SocialLogin:
     '''Social media login.'''
 
     def __init__(self, provider: str):
 
-        self.config = SocialConfig().CONFIG
-        self.key = SocialConfig().SECRET_KEY
         self.provider = provider
-        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
     def login(self, request):
 
-        authomatic = Authomatic(
-            self.config, self.key, report_errors=True)
-
-        response = make_response()
-        result = authomatic.login(WerkzeugAdapter(
-            request, response),
-            self.provider)
-            
-        return response, result
+        return social.login(self.provider, request)
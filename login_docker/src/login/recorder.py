@@ -0,0 +1,180 @@
+'''
+Write-behind recording of logins.
+
+Logins are buffered in memory, coalesced per user for last_login, and
+written in bulk together with the login_events audit rows every
+LOGIN_FLUSH_INTERVAL seconds, once LOGIN_FLUSH_SIZE logins are waiting,
+and when the worker shuts down.
+'''
+
+import atexit
+import datetime
+import logging
+from threading import Event, Lock, Thread
+
+from flask import request
+from sqlalchemy import bindparam, text
+
+from src import db, user_cache
+from src.models import User
+
+
+logger = logging.getLogger(__name__)
+
+# Users per UPDATE ... FROM (VALUES ...) statement.
+UPDATE_CHUNK = 1000
+
+
+class LoginEvent(db.Model):
+    '''Login audit row.'''
+
+    __tablename__ = 'login_events'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+    user_id = db.Column(
+        db.Integer,
+        index=True,
+        nullable=False
+    )
+    at = db.Column(
+        db.DateTime,
+        nullable=False
+    )
+    method = db.Column(
+        db.String(10),
+        nullable=False
+    )
+    ip = db.Column(
+        db.String(45),
+        nullable=True
+    )
+
+    def __repr__(self):
+
+        return '<LoginEvent {} {}>'.format(self.user_id, self.at)
+
+
+class LoginRecorder:
+    '''Buffer logins and flush them in bulk.'''
+
+    def __init__(self, app=None):
+
+        self.app = None
+        self.interval = 5
+        self.size = 500
+        self._last_login = {}
+        self._events = []
+        self._lock = Lock()
+        self._wake = Event()
+        self._stopping = Event()
+        self._thread = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.interval = app.config.get('LOGIN_FLUSH_INTERVAL', self.interval)
+        self.size = app.config.get('LOGIN_FLUSH_SIZE', self.size)
+        app.extensions['login_recorder'] = self
+        atexit.register(self.stop)
+
+    def record(self, user, method: str):
+        '''Queue a successful login.'''
+
+        now = datetime.datetime.now()
+        with self._lock:
+            self._last_login[user.id] = now
+            self._events.append({
+                'user_id': user.id,
+                'at': now,
+                'method': method,
+                'ip': request.remote_addr
+            })
+            waiting = len(self._events)
+
+            # Started lazily, after gunicorn forked the worker.
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(
+                    target=self.run, name='login-recorder', daemon=True)
+                self._thread.start()
+
+        if waiting >= self.size:
+            self._wake.set()
+
+    def run(self):
+
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self):
+        '''Stop the flush thread and write everything still buffered.'''
+
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(10)
+        self.flush()
+
+    def flush(self):
+        '''Write buffered logins, return how many.'''
+
+        with self._lock:
+            last_login, self._last_login = self._last_login, {}
+            events, self._events = self._events, []
+
+        if not events:
+            return 0
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    self.update_last_login(conn, last_login)
+                    conn.execute(LoginEvent.__table__.insert(), events)
+        except Exception:
+            logger.exception('Dropped %s login records.', len(events))
+            return 0
+
+        for user_id in last_login:
+            user_cache.invalidate(user_id)
+        return len(events)
+
+    @staticmethod
+    def update_last_login(conn, last_login: dict):
+        '''Bulk UPDATE of last_login, one row per user.'''
+
+        if conn.dialect.name == 'postgresql':
+            items = list(last_login.items())
+            for start in range(0, len(items), UPDATE_CHUNK):
+                rows, params = [], {}
+                chunk = items[start:start + UPDATE_CHUNK]
+                for i, (user_id, at) in enumerate(chunk):
+                    rows.append(
+                        '(:id{0}, CAST(:at{0} AS TIMESTAMP))'.format(i))
+                    params['id{}'.format(i)] = user_id
+                    params['at{}'.format(i)] = at
+
+                conn.execute(text(
+                    'UPDATE users SET last_login = v.at '
+                    'FROM (VALUES {}) AS v (id, at) '
+                    'WHERE users.id = v.id'.format(', '.join(rows))
+                ), params)
+            return
+
+        conn.execute(
+            User.__table__.update().where(
+                User.id == bindparam('user_id')
+            ).values(
+                last_login=bindparam('at')
+            ),
+            [{'user_id': k, 'at': v} for k, v in last_login.items()]
+        )
+
+
+recorder = LoginRecorder()
@@ -0,0 +1,108 @@
+'''Rendered-page cache for the anonymous auth pages.'''
+
+import os
+from threading import Lock
+
+from flask import render_template, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+from src.metrics import metrics
+
+
+# Stand in for the per-request parts of a cached page.
+CSRF_SLOT = '__CSRF_TOKEN__'
+FLASH_SLOT = '__FLASHES__'
+
+
+class RenderCache:
+    '''
+    Cache anonymous GET renders of login, signup, reset and recover.
+
+    A page is rendered once with slots for the CSRF token and the flash
+    messages, which are spliced in per request. In debug mode pages are
+    re-rendered when a template changes.
+    '''
+
+    def __init__(self, app=None):
+
+        self.app = None
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._pages = {}
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.enabled = app.config.get('RENDER_CACHE', self.enabled)
+        app.extensions['render_cache'] = self
+        metrics.worker_collector(self.collect)
+
+    def render(self, template_name: str, form, **context):
+        '''render_template() with the page served from cache when possible.'''
+
+        if (not self.enabled or request.method != 'GET'
+                or current_user.is_authenticated):
+            return render_template(template_name, form=form, **context)
+
+        key = (template_name, tuple(sorted(context.items())), self.stamp())
+        page = self._pages.get(key)
+        if page is None:
+            self.misses += 1
+            page = render_template(
+                template_name,
+                form=form,
+                flash_slot=Markup(FLASH_SLOT),
+                **context
+            )
+            if 'csrf_token' in form:  # Unless WTF_CSRF_ENABLED is off.
+                page = page.replace(form.csrf_token.current_token, CSRF_SLOT)
+            with self._lock:
+                self._pages[key] = page
+        else:
+            self.hits += 1
+
+        flashes = ''
+        if session.get('_flashes'):
+            flashes = render_template('flashes.jinja2')
+
+        return page.replace(
+            CSRF_SLOT, generate_csrf()).replace(FLASH_SLOT, flashes)
+
+    def stamp(self):
+        '''Latest template change in debug mode, 0 otherwise.'''
+
+        if not self.app.debug:
+            return 0
+
+        folder = os.path.join(self.app.root_path, self.app.template_folder)
+        return max(entry.stat().st_mtime for entry in os.scandir(folder))
+
+    def clear(self):
+
+        with self._lock:
+            self._pages.clear()
+
+    def collect(self):
+        '''Samples for the metrics endpoint.'''
+
+        return [
+            ('render_cache_hits_total', 'counter',
+             'Auth pages served from the render cache.', self.hits),
+            ('render_cache_misses_total', 'counter',
+             'Auth pages rendered into the render cache.', self.misses),
+        ]
+
+    def stats(self):
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._pages)
+        }
@@ -1,15 +1,25 @@
 ''' 
 Login routes.
-[signup, login, reset, confirm, recover]
+[signup, login, reset, confirm, recover, verify, token]
 '''
 
-from flask import redirect, render_template, flash, Blueprint, request, url_for
-from flask_login import current_user, login_user, logout_user
+from urllib.parse import quote
+
+from flask import (
+    current_app, redirect, render_template, flash, Blueprint, request,
+    url_for, make_response, jsonify
+)
+from flask_login import current_user, login_required, login_user, logout_user
 
 from src.login.forms import LoginForm, SignupForm, ResetForm, RecoverForm
 from src.models import db, User, CreateUser
-from src.login.models import SocialLogin
-from src import login_manager
+from src.login.models import SocialLogin, UserToken
+from src.login import session as claims
+from src.login.throttle import throttle
+from src.login.recorder import recorder
+from src.mailer.mail import Mailer, ConfirmMail, ResetMail
+from src.queries import query_budget
+from src import login_manager, render_cache, replicas, user_cache
 
 
 # Blueprint config.
@@ -22,6 +32,8 @@ auth_bp = Blueprint(
 
 @auth_bp.route(
     '/signup', methods=['GET', 'POST'])
+@query_budget('POST', SELECT=1, INSERT=2, UPDATE=0)
+@throttle.limit('signup')
 def signup():
     '''
     User sign-up page.
@@ -33,24 +45,25 @@ def signup():
     form = SignupForm()
     if form.validate_on_submit():
         email = form.email.data
-        if User.exist(email=email):  # User exists.
+        if User.lookup(email=email):  # User exists.
             flash('User exists.')
         else:
             create_u = CreateUser(email=email)
             user = create_u.create(
                 name=form.name.data,
                 password=form.password.data,
-                login_type="site"
+                login_type="site",
+                commit=False,
+                signup=True
             )
-            create_u.commit_db()
 
-            from src.mailer.mail import Mailer, ConfirmMail
             msg = ConfirmMail(user.email)
             mailer = Mailer(msg)
 
-            # Send email with reset uri.
+            # Queue the confirm mail in the same transaction as the user.
             mailer.send()
-            flash('We just sent you an email to confirm your account.')
+            if create_u.commit_db():
+                flash('We just sent you an email to confirm your account.')
 
         # Login page.
         return render_template(
@@ -61,7 +74,7 @@ def signup():
         )
 
     # Signup page.
-    return render_template(
+    return render_cache.render(
         'signup.jinja2',
         title='Join  our community!',
         form=form,
@@ -73,6 +86,8 @@ def signup():
     '/login/', methods=['GET', 'POST'])
 @auth_bp.route(  # Social media login.
     '/login/<provider>', methods=['GET', 'POST'])
+@query_budget('POST', SELECT=1, INSERT=0, UPDATE=1)
+@throttle.limit('login')
 def login(provider=None):
     '''
     User login page.
@@ -99,18 +114,19 @@ def login(provider=None):
                 result.user.update()
                 email = result.user.email
 
-                if not User.exist(email=email):
+                user = User.lookup(email=email)
+                if user is None:
                     # Create user.
                     create_u = CreateUser(email=email)
                     user = create_u.create(
                         name=result.user.name,
                         login_type=provider
                     )
-                else:
-                    user = User.get(email=email)
 
                 # Login.
                 login_user(user=user)
+                claims.start_session(user)
+                recorder.record(user, method=provider)
 
             next_page = request.args.get('next')
             return redirect(next_page or url_for('main_bp.main'))
@@ -122,11 +138,20 @@ def login(provider=None):
 
             email = form.email.data
 
-            if User.exist(email=email):
-                user = User.get(email=email)
-                if user and user.confirmed and user.check_password(form.password.data):
+            user = User.lookup(email=email, replica=True)
+            if user:
+                if user.confirmed and user.check_password(form.password.data):
 
                     login_user(user)
+                    claims.start_session(user)
+                    recorder.record(user, method='site')
+
+                    # Upgrade legacy or outdated password hashes.
+                    if user.rehash_password(form.password.data):
+                        user_id = user.id  # Before commit expires it.
+                        db.session.commit()
+                        user_cache.invalidate(user_id)
+
                     # Logged in.
                     next_page = request.args.get('next')
                     return redirect(next_page or url_for('main_bp.main'))
@@ -136,7 +161,7 @@ def login(provider=None):
             # return redirect(url_for('auth_bp.login'))
 
     # Login page.
-    return render_template(
+    return render_cache.render(
         'login.jinja2',
         form=form,
         title='Log in.',
@@ -146,6 +171,8 @@ def login(provider=None):
 
 @auth_bp.route(  # Forgot password.
     '/reset', methods=['GET', 'POST'])
+@query_budget('POST', SELECT=1, INSERT=1, UPDATE=0)
+@throttle.limit('reset')
 def reset():
     '''
     Reset password page.
@@ -158,21 +185,20 @@ def reset():
     if form.validate_on_submit():
         email = form.email.data
 
-        if User.exist(email=email):
-
-            user = User.get(email=email)
+        user = User.lookup(email=email)
+        if user:
 
-            from src.mailer.mail import Mailer, ResetMail
             msg = ResetMail(user.email)
 
             mailer = Mailer(msg)
-            # Send email with reset uri.
+            # Queue email with reset uri.
             mailer.send()
+            db.session.commit()
             flash('An email sent to you.')
         else:
             flash('The email address is not registered.')
 
-    return render_template(
+    return render_cache.render(
         'reset.jinja2',
         title='Password recovery.',
         form=form,
@@ -182,20 +208,27 @@ def reset():
 
 @auth_bp.route(  # Confirm.
     '/confirm/<token>', methods=['GET', 'POST'])
+@query_budget(SELECT=1, INSERT=0, UPDATE=1)
 def confirm(token=None):
     ''''''
-    from src.login.models import UserToken
-    email = UserToken.verify(token)
+    # Spent once, a replayed link is turned away before any query.
+    email = UserToken.verify(token, 'confirm', spend=True)
 
     if not email:
         flash('User not found.')
         return redirect(url_for('auth_bp.login'))
 
-    user = User.query.filter_by(email=email).first()
+    user = User.lookup(email=email)
     if user:
+        login_user(user)
+        claims.start_session(user)
+        recorder.record(user, method='confirm')
+
+        user_id = user.id  # Before commit expires it.
         user.confirmed = True
         db.session.commit()
-        login_user(user)
+        user_cache.invalidate(user_id)
+
         next_page = request.args.get('next')
         return redirect(next_page or url_for('main_bp.main'))
 
@@ -213,6 +246,7 @@ def confirm(token=None):
     '/recover/', methods=['GET', 'POST'])
 @auth_bp.route(  # Recover.
     '/recover/<token>', methods=['GET', 'POST'])
+@query_budget('POST', SELECT=1, INSERT=0, UPDATE=1)
 def recover(token=None):
     '''
     User login page.
@@ -224,29 +258,34 @@ def recover(token=None):
     [POST] Validate form & change password.
     '''
 
-    if request.method == 'GET':
-        from src.login.models import UserToken
-        email = UserToken.verify(token)
+    email = UserToken.verify(token, 'recover')
 
-        if not email:
-            flash('User not found.')
-            return redirect(url_for('auth_bp.login'))
+    if not email:
+        flash('User not found.')
+        return redirect(url_for('auth_bp.login'))
 
     form = RecoverForm()
     if form.validate_on_submit():
 
-        email = form.email.data
-        if User.exist(email=email):
-            user = User.get(email=email)
+        # The password is changed once per link.
+        if not UserToken.verify(token, 'recover', spend=True):
+            flash('User not found.')
+            return redirect(url_for('auth_bp.login'))
+
+        user = User.lookup(email=email)
+        if user:
             # Change password and commit.
+            user_id = user.id  # Before commit expires it.
             user.set_password(form.password.data)
+            user.revoke_sessions()
             db.session.commit()
+            user_cache.invalidate(user_id)
 
             flash('Password changed.')
             return redirect(url_for('auth_bp.login'))
 
     # Change password page.
-    return render_template(
+    return render_cache.render(
         'recover.jinja2',
         title='Reset your password.',
         form=form,
@@ -254,13 +293,104 @@ def recover(token=None):
     )
 
 
+@auth_bp.route(  # nginx auth_request.
+    '/auth/verify', methods=['GET'])
+@query_budget(SELECT=1, INSERT=0, UPDATE=0)
+def verify():
+    '''
+    Identity check for nginx auth_request, nothing is rendered.
+
+    [GET] 200 with X-Auth-User-* headers for a logged in session or a
+    bearer token from /auth/token of a confirmed user, 401 otherwise.
+    '''
+
+    user = None
+    if current_user.is_authenticated:
+        user = current_user
+    else:
+        auth = request.headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            token_claims = UserToken.claims(auth[len('Bearer '):], 'access')
+            if token_claims:
+                user = User.lookup(email=token_claims['email'], replica=True)
+            # Revoked with the sessions by a session version bump.
+            if user is not None and (
+                    not user.confirmed
+                    or user.session_version != token_claims.get('ver')):
+                user = None
+
+    if user is None:
+        return '', 401
+
+    response = make_response('', 200)
+    response.headers['X-Auth-User-Id'] = str(user.id)
+    response.headers['X-Auth-User-Email'] = user.email
+    response.headers['X-Auth-User-Name'] = quote(user.name)
+    response.headers['X-Auth-Login-Type'] = user.login_type
+
+    # Lets nginx cache the positive result for a few seconds.
+    response.headers['X-Accel-Expires'] = str(
+        current_app.config['AUTH_VERIFY_CACHE_TTL'])
+    return response
+
+
+@auth_bp.route(  # Bearer token for /auth/verify.
+    '/auth/token', methods=['POST'])
+@query_budget(SELECT=1, INSERT=0, UPDATE=0)
+@login_required
+def token():
+    '''
+    Access token of the logged in user.
+
+    [POST] JSON with a bearer token valid ACCESS_TOKEN_TTL seconds, or
+    until the user's sessions are revoked.
+    '''
+
+    access_token = UserToken.create_access(current_user)
+    if isinstance(access_token, bytes):
+        access_token = access_token.decode()
+
+    response = jsonify({
+        'access_token': access_token,
+        'token_type': 'Bearer',
+        'expires_in': current_app.config['ACCESS_TOKEN_TTL']
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 @login_manager.user_loader
 def load_user(user_id):
     ''' Check if user is logged-in upon page load.  '''
 
-    if user_id is not None:
-        return User.query.get(user_id)
-    return None
+    if user_id is None:
+        return None
+
+    if claims.enabled():
+        valid = claims.read_claims(user_id)
+        if valid:
+            return claims.ClaimsUser(valid)
+
+    user = user_cache.get(user_id)
+    if user is None:
+        with replicas.reading():
+            user = User.query.get(user_id)
+        if user is None:
+            return None
+
+        # Keep a detached copy, commits in this request must not expire it.
+        db.session.expunge(user)
+        user_cache.set(user_id, user)
+
+    if claims.enabled():
+        # Sessions are revoked by bumping the user's session version.
+        if claims.revoked(user):
+            claims.end_session()
+            return None
+        claims.issue_claims(user)
+
+    # Attach the cached row to this request's session without a query.
+    return db.session.merge(user, load=False)
 
 
 @login_manager.unauthorized_handler
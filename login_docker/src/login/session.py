@@ -0,0 +1,115 @@
+'''
+Signed session claims.
+
+With SESSION_CLAIMS enabled the user's id, name, email, login type and
+session version are kept in the signed session cookie, and current_user
+is served from them until they expire after SESSION_CLAIMS_TTL seconds.
+Bumping User.session_version revokes every session once its claims
+expire.
+'''
+
+import datetime
+from time import time
+
+from flask import current_app, session
+from flask_login import UserMixin
+
+from src.models import User
+
+
+CLAIMS_KEY = '_claims'
+
+
+class ClaimsUser(UserMixin):
+    '''Logged in user rebuilt from session claims.'''
+
+    def __init__(self, claims: dict):
+
+        self.id = claims['id']
+        self.name = claims['name']
+        self.email = claims['email']
+        self.login_type = claims['login_type']
+        self.session_version = claims['ver']
+        self.last_login = claims['last_login']
+
+    def get_last_login(self):
+        '''Get last login time.'''
+
+        if self.last_login is None:
+            return ''
+
+        last_login = datetime.datetime.fromisoformat(self.last_login)
+        return last_login.strftime('%d %b %Y - %H:%M:%S')
+
+    def get_row(self):
+        '''Database row for routes that change the user, None if deleted.'''
+
+        return User.query.get(self.id)
+
+    def __repr__(self):
+
+        return '<ClaimsUser {}>'.format(self.name)
+
+
+def enabled():
+
+    return current_app.config['SESSION_CLAIMS']
+
+
+def read_claims(user_id):
+    '''Unexpired claims of user_id from the session, or None.'''
+
+    claims = session.get(CLAIMS_KEY)
+    if not claims or str(claims['id']) != str(user_id):
+        return None
+    if claims['exp'] < time():
+        return None
+
+    return claims
+
+
+def issue_claims(user):
+    '''Store fresh claims for a user loaded from the database.'''
+
+    last_login = user.last_login.isoformat() if user.last_login else None
+    session[CLAIMS_KEY] = {
+        'id': user.id,
+        'name': user.name,
+        'email': user.email,
+        'login_type': user.login_type,
+        'ver': user.session_version,
+        'last_login': last_login,
+        'exp': time() + current_app.config['SESSION_CLAIMS_TTL']
+    }
+
+
+def revoked(user):
+    '''If the session's claims predate a session version bump.'''
+
+    claims = session.get(CLAIMS_KEY)
+    if not claims or str(claims['id']) != str(user.id):
+        return False
+
+    return claims['ver'] != user.session_version
+
+
+def start_session(user):
+    '''Claims of a user just logged in, never those of an earlier login.'''
+
+    if enabled():
+        issue_claims(user)
+    else:
+        session.pop(CLAIMS_KEY, None)
+
+
+def clear_claims():
+    '''Drop the claims when the user logs out.'''
+
+    session.pop(CLAIMS_KEY, None)
+
+
+def end_session():
+    '''Log a revoked session out, from within the user loader.'''
+
+    for key in (CLAIMS_KEY, '_user_id', '_fresh', '_id'):
+        session.pop(key, None)
@@ -0,0 +1,338 @@
+'''
+Process-wide registry of the social login providers.
+
+One Authomatic instance per worker, built on the first social login.
+Provider HTTP calls (token exchange, user info) go through a keep-alive
+connection pool with SOCIAL_HTTP_TIMEOUT, and each provider has a
+bulkhead and a circuit breaker: at most SOCIAL_MAX_CONCURRENT calls in
+flight per worker, and after SOCIAL_BREAKER_FAILURES failures in a row
+the provider is failed fast with a 503 for SOCIAL_BREAKER_RESET
+seconds. A slow Facebook or Google endpoint then costs a few threads
+for a few seconds instead of every worker.
+'''
+
+import http.client
+import os
+import sys
+from io import BytesIO
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+
+from flask import make_response
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+
+from src.config import SocialConfig
+from src.metrics import SOCIAL_FAILURES
+
+
+class ProviderUnavailable(ServiceUnavailable):
+    '''The provider is failing or saturated, fail fast.'''
+
+    description = 'This login provider is not responding, please try again later.'
+
+
+class CircuitBreaker:
+    '''Open after `failures` failures in a row, retry one call after `reset`.'''
+
+    def __init__(self, failures: int, reset: float):
+
+        self.threshold = failures
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self._lock = Lock()
+
+    def allow(self):
+        '''If a call may go out now.'''
+
+        with self._lock:
+            if self.opened is None:
+                return True
+            if monotonic() - self.opened >= self.reset:
+                # Half open, let this call probe the provider.
+                self.opened = monotonic()
+                return True
+            return False
+
+    def success(self):
+
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = monotonic()
+
+    def ready(self):
+        '''If allow() would let a call through, without claiming it.'''
+
+        opened = self.opened
+        return opened is None or monotonic() - opened >= self.reset
+
+
+class BufferedResponse:
+    '''http.client response whose body was read, so the connection is free.'''
+
+    def __init__(self, response, body: bytes):
+
+        self._response = response
+        self._body = BytesIO(body)
+        self.msg = response.msg
+        self.version = response.version
+        self.status = response.status
+        self.reason = response.reason
+
+    def read(self, amt=None):
+
+        return self._body.read(amt)
+
+    def getheader(self, name, default=None):
+
+        return self._response.getheader(name, default)
+
+    def getheaders(self):
+
+        return self._response.getheaders()
+
+
+class PooledConnection:
+    '''Connection handed to authomatic, pooled again once answered.'''
+
+    def __init__(self, pool, key, conn, reused: bool):
+
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.reused = reused
+
+    def request(self, method, url, body=None, headers=None):
+
+        try:
+            self.conn.request(method, url, body, headers or {})
+        except (http.client.HTTPException, OSError):
+            if not self.reused:
+                raise
+            # The provider closed the idle keep-alive connection.
+            self.conn.close()
+            self.conn = self.pool.new(self.key)
+            self.reused = False
+            self.conn.request(method, url, body, headers or {})
+
+    def getresponse(self):
+
+        try:
+            response = self.conn.getresponse()
+            body = response.read()
+        except Exception:
+            self.conn.close()
+            raise
+
+        if response.will_close:
+            self.conn.close()
+        else:
+            self.pool.put(self.key, self.conn)
+        return BufferedResponse(response, body)
+
+
+class ConnectionPool:
+    '''
+    Idle keep-alive connections per host, with timeouts.
+
+    Stands in for the http_client module authomatic connects with.
+    '''
+
+    def __init__(self, size: int = 4, timeout: float = 5):
+
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._pid = os.getpid()
+        self._lock = Lock()
+
+    def new(self, key):
+
+        scheme, host, port, cert_file = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(
+                host, port=port, cert_file=cert_file, timeout=self.timeout)
+        return http.client.HTTPConnection(
+            host, port=port, timeout=self.timeout)
+
+    def get(self, key):
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share sockets with the process we forked from.
+                self._idle, self._pid = {}, os.getpid()
+            idle = self._idle.get(key)
+            if idle:
+                return PooledConnection(self, key, idle.pop(), True)
+        return PooledConnection(self, key, self.new(key), False)
+
+    def put(self, key, conn):
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def HTTPSConnection(self, host, port=None, cert_file=None, context=None):
+
+        if context is not None:
+            # Unverified SSL, keep it out of the pool.
+            return http.client.HTTPSConnection(
+                host, port=port, context=context, timeout=self.timeout)
+        return self.get(('https', host, port, cert_file))
+
+    def HTTPConnection(self, host, port=None):
+
+        return self.get(('http', host, port, None))
+
+    def __getattr__(self, name):
+
+        return getattr(http.client, name)
+
+
+class Provider:
+    '''Bulkhead and circuit breaker of one provider.'''
+
+    def __init__(self, name: str, max_concurrent: int, breaker):
+
+        self.name = name
+        self.slots = BoundedSemaphore(max_concurrent)
+        self.breaker = breaker
+
+    def call(self, fn, *args, **kwargs):
+        '''Run a provider HTTP call, failing fast while it is unhealthy.'''
+
+        if not self.breaker.allow():
+            SOCIAL_FAILURES.inc(self.name, 'open')
+            raise ProviderUnavailable()
+        if not self.slots.acquire(blocking=False):
+            SOCIAL_FAILURES.inc(self.name, 'saturated')
+            raise ProviderUnavailable()
+
+        try:
+            response = fn(*args, **kwargs)
+        except Exception as e:
+            self.breaker.failure()
+            SOCIAL_FAILURES.inc(self.name, type(e).__name__)
+            raise ProviderUnavailable() from e
+        finally:
+            self.slots.release()
+
+        if response.status >= 500:
+            self.breaker.failure()
+            SOCIAL_FAILURES.inc(self.name, 'status')
+        else:
+            self.breaker.success()
+        return response
+
+
+class SocialProviders:
+    '''Extension holding the Authomatic instance and provider guards.'''
+
+    def __init__(self, app=None):
+
+        self.config = {}
+        self.secret = None
+        self.providers = {}
+        self.pool = ConnectionPool()
+        self._authomatic = None
+        self._adapter = None
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.config = SocialConfig.CONFIG
+        self.secret = SocialConfig.SECRET_KEY
+        self.pool = ConnectionPool(
+            size=app.config['SOCIAL_POOL_SIZE'],
+            timeout=app.config['SOCIAL_HTTP_TIMEOUT']
+        )
+        self.providers = {
+            name: Provider(
+                name,
+                app.config['SOCIAL_MAX_CONCURRENT'],
+                CircuitBreaker(
+                    app.config['SOCIAL_BREAKER_FAILURES'],
+                    app.config['SOCIAL_BREAKER_RESET']
+                )
+            ) for name in self.config
+        }
+        app.extensions['social'] = self
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+    def get_authomatic(self):
+        '''(Authomatic, WerkzeugAdapter), built on the first social login.'''
+
+        with self._lock:
+            if self._authomatic is None:
+                import authomatic.providers
+                from authomatic import Authomatic
+                from authomatic.adapters import WerkzeugAdapter
+
+                # Every provider connects through the pool.
+                authomatic.providers.http_client = self.pool
+
+                config = {}
+                for name, settings in self.config.items():
+                    config[name] = dict(
+                        settings, class_=self.guarded_class(
+                            name, settings['class_']))
+
+                self._authomatic = Authomatic(
+                    config, self.secret, report_errors=True)
+                self._adapter = WerkzeugAdapter
+
+            return self._authomatic, self._adapter
+
+    def guarded_class(self, name: str, class_):
+        '''Subclass of a provider class whose HTTP calls are guarded.'''
+
+        from authomatic.core import resolve_provider_class
+
+        base = resolve_provider_class(class_)
+        provider = self.providers[name]
+
+        def _fetch(self, *args, **kwargs):
+            return provider.call(super(guarded, self)._fetch, *args, **kwargs)
+
+        # authomatic serializes credentials with the id of the provider
+        # class, looked up in the PROVIDER_ID_MAP of its module.
+        module = sys.modules[base.__module__]
+        type_id = '{}-{}'.format(
+            base.PROVIDER_TYPE_ID, module.PROVIDER_ID_MAP.index(base))
+
+        guarded = type(base.__name__, (base,), {
+            '_fetch': _fetch,
+            '__module__': base.__module__,
+            'type_id': type_id,
+        })
+        return guarded
+
+    def login(self, provider: str, request):
+        '''Run the authomatic login flow, return (response, result).'''
+
+        if provider not in self.providers:
+            raise NotFound()
+        if not self.providers[provider].breaker.ready():
+            SOCIAL_FAILURES.inc(provider, 'open')
+            raise ProviderUnavailable()
+
+        authomatic, adapter = self.get_authomatic()
+        response = make_response()
+        result = authomatic.login(adapter(request, response), provider)
+        return response, result
+
+
+social = SocialProviders()
@@ -0,0 +1,101 @@
+'''Sliding-window throttling of auth form posts.'''
+
+from functools import wraps
+from time import time
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+from src import store
+
+
+class Throttle:
+    '''
+    Limit POSTs to a view per client IP and per submitted email.
+
+    Limits come from THROTTLE_<NAME>_IP / THROTTLE_<NAME>_EMAIL settings
+    in 'count/seconds' form. Counters live in the shared store, so the
+    limit holds across gunicorn workers, and are checked before the view
+    runs any query or password hash.
+    '''
+
+    SCOPES = ('ip', 'email')
+
+    def __init__(self, app=None):
+
+        self.enabled = True
+        self.app = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.enabled = app.config.get('THROTTLE', self.enabled)
+        app.extensions['throttle'] = self
+
+    def get_limit(self, name: str, scope: str):
+        '''(count, seconds) for a view and scope, or None.'''
+
+        setting = self.app.config.get(
+            'THROTTLE_{}_{}'.format(name, scope).upper())
+        if not setting:
+            return None
+
+        count, seconds = setting.split('/')
+        return int(count), int(seconds)
+
+    def limit(self, name: str):
+        '''Decorator throttling POSTs to a view.'''
+
+        def decorator(view):
+
+            @wraps(view)
+            def throttled(*args, **kwargs):
+                if self.enabled and request.method == 'POST':
+                    self.check(name)
+                return view(*args, **kwargs)
+
+            return throttled
+
+        return decorator
+
+    def check(self, name: str):
+        '''Count this request, raise TooManyRequests over a limit.'''
+
+        values = {
+            'ip': request.remote_addr,
+            'email': request.form.get('email', '').strip().lower()
+        }
+        for scope in self.SCOPES:
+            limit = self.get_limit(name, scope)
+            if limit and values[scope]:
+                key = 'throttle:{}:{}:{}'.format(name, scope, values[scope])
+                retry_after = self.hit(key, *limit)
+                if retry_after:
+                    raise TooManyRequests(retry_after=retry_after)
+
+    def hit(self, key: str, count: int, seconds: int):
+        '''
+        Record a hit, return seconds to wait if over the limit, else 0.
+
+        The sliding window is estimated from the current and previous
+        fixed windows, weighting the previous one by how much of it still
+        overlaps the last `seconds`.
+        '''
+
+        now = time()
+        window = int(now // seconds)
+        current = store.incr(
+            '{}:{}'.format(key, window), ttl=2 * seconds)
+        previous = store.get('{}:{}'.format(key, window - 1)) or 0
+
+        elapsed = (now % seconds) / seconds
+        if previous * (1 - elapsed) + current <= count:
+            return 0
+
+        return int(seconds - now % seconds) + 1
+
+
+throttle = Throttle()
@@ -0,0 +1,199 @@
+'''
+Signed tokens: one-time confirm and recover links, and access tokens
+for the nginx auth_request bearer check.
+
+Signing keys are read once from TOKEN_KEYS, comma separated 'kid:secret'
+pairs; the first one signs, the others still verify. To rotate, put a
+new key first and drop the old one after TOKEN_TTL seconds. Without
+TOKEN_KEYS, SECRET_KEY signs as kid 'default'.
+
+Each token names its purpose in the 'typ' claim and is only accepted
+for that purpose, so a mailed link is never a bearer token and a
+confirm link never changes a password.
+
+Access tokens are issued to a logged in user by POST /auth/token and
+are valid ACCESS_TOKEN_TTL seconds. They carry the user's session
+version: User.revoke_sessions() (a password recovery) revokes every
+access token of the user along with the sessions, give or take the
+AUTH_VERIFY_CACHE_TTL seconds nginx caches a positive check.
+
+Tokens are HS256 only and carry a random jti. A spent jti is added to
+the shared store until the token expires, so it is spent once across
+workers, and to a per-worker set bucketed by expiry, so replays and
+expired tokens are rejected before any database access.
+'''
+
+import logging
+from secrets import token_urlsafe
+from threading import Lock
+from time import time
+
+import jwt
+
+from src import store
+from src.metrics import TOKEN_FAILURES
+
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = 'HS256'
+
+PURPOSES = ('access', 'confirm', 'recover')
+
+
+class UsedTokens:
+    '''jti of spent tokens, in buckets dropped once their tokens expired.'''
+
+    BUCKET = 60
+
+    def __init__(self):
+
+        self._buckets = {}
+        self._lock = Lock()
+
+    def __contains__(self, token):
+
+        jti, exp = token
+        return jti in self._buckets.get(int(exp // self.BUCKET), ())
+
+    def add(self, jti: str, exp: float):
+
+        bucket = int(exp // self.BUCKET)
+        with self._lock:
+            # Every token of a bucket ending before now has expired.
+            expired = int(time() // self.BUCKET)
+            for old in [b for b in self._buckets if b < expired]:
+                del self._buckets[old]
+            self._buckets.setdefault(bucket, set()).add(jti)
+
+
+class TokenService:
+    '''Extension creating and verifying the tokens.'''
+
+    def __init__(self, app=None):
+
+        self.keys = {}
+        self.kid = None
+        self.ttl = 600
+        self.access_ttl = 3600
+        self.used = UsedTokens()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.keys, self.kid = self.parse_keys(
+            app.config['TOKEN_KEYS'], app.config['SECRET_KEY'])
+        self.ttl = app.config['TOKEN_TTL']
+        self.access_ttl = app.config['ACCESS_TOKEN_TTL']
+        app.extensions['tokens'] = self
+
+    @staticmethod
+    def parse_keys(spec: str, secret: str):
+        '''({kid: secret}, signing kid) from TOKEN_KEYS or SECRET_KEY.'''
+
+        keys = []
+        for item in (spec or '').split(','):
+            if not item.strip():
+                continue
+            kid, _, key = item.strip().partition(':')
+            if not kid or not key:
+                raise ValueError('TOKEN_KEYS entries are kid:secret.')
+            keys.append((kid, key))
+
+        if not keys and secret:
+            keys = [('default', secret)]
+        if not keys:
+            return {}, None
+        return dict(keys), keys[0][0]
+
+    def create(self, email: str, purpose: str, expires: int = None,
+               version: int = None):
+        '''
+        Token for `email` and one of PURPOSES, valid `expires` seconds.
+
+        version: session version of the user, checked by the verifier.
+        '''
+
+        if purpose not in PURPOSES:
+            raise ValueError('Unknown token purpose {!r}.'.format(purpose))
+
+        claims = {
+            'email': email,
+            'typ': purpose,
+            'exp': int(time() + (self.ttl if expires is None else expires)),
+            'jti': token_urlsafe(12)
+        }
+        if version is not None:
+            claims['ver'] = version
+
+        return jwt.encode(
+            claims,
+            key=self.keys[self.kid],
+            algorithm=ALGORITHM,
+            headers={'kid': self.kid}
+        )
+
+    def create_access(self, user):
+        '''Bearer token of a user, valid ACCESS_TOKEN_TTL seconds.'''
+
+        return self.create(
+            user.email, 'access', self.access_ttl,
+            version=user.session_version or 0)
+
+    def verify(self, token: str, purpose: str, spend: bool = False):
+        '''
+        Email of a valid, unspent token made for `purpose`, or False.
+
+        spend: mark the token used, only the first call succeeds.
+        '''
+
+        claims = self.claims(token, purpose, spend)
+        return claims and claims['email']
+
+    def claims(self, token: str, purpose: str, spend: bool = False):
+        '''Claims of a valid, unspent token made for `purpose`, or False.'''
+
+        if not token:
+            return self.reject('invalid')
+
+        try:
+            kid = jwt.get_unverified_header(token).get('kid', 'default')
+            key = self.keys.get(kid)
+            if key is None:
+                return self.reject('key')
+            claims = jwt.decode(token, key=key, algorithms=[ALGORITHM])
+            jti, exp, _ = claims['jti'], claims['exp'], claims['email']
+        except jwt.ExpiredSignatureError:
+            return self.reject('expired')
+        except (jwt.InvalidTokenError, KeyError, TypeError):
+            return self.reject('invalid')
+
+        if claims.get('typ') != purpose:
+            return self.reject('purpose')
+
+        if (jti, exp) in self.used:
+            return self.reject('replayed')
+
+        key = 'jti:{}'.format(jti)
+        if spend:
+            fresh = store.add(key, exp - time() + 1)
+        else:
+            fresh = store.get(key) is None
+
+        if not fresh or spend:
+            self.used.add(jti, exp)
+        if not fresh:
+            return self.reject('replayed')
+        return claims
+
+    @staticmethod
+    def reject(reason: str):
+
+        TOKEN_FAILURES.inc(reason)
+        logger.info('Token rejected: %s', reason, extra={'reason': reason})
+        return False
+
+
+tokens = TokenService()
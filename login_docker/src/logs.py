@@ -0,0 +1,254 @@
+'''
+Structured logging off the request thread.
+
+Records are put on a bounded in-memory queue and written to stdout by a
+listener thread of each worker, as JSON lines (LOG_FORMAT=json) with
+the request id, route, user id and request timing. A request thread
+never waits on I/O: when the queue is full the record is dropped and
+counted in log_records_dropped_total.
+
+Repeated records (same logger and message) are sampled: at most
+LOG_SAMPLE_BURST per second each, the next one emitted carries the
+number suppressed. A storm of failing token checks then costs its
+requests a dict lookup per record, not a write each.
+
+LOG_LEVEL sets the root level, LOG_LEVELS per module levels, e.g.
+'src.login.tokens=WARNING,sqlalchemy.engine=INFO'. Requests slower
+than LOG_SLOW_REQUEST_MS are logged, every request with LOG_REQUESTS.
+'''
+
+import atexit
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from threading import Lock
+from time import monotonic, perf_counter
+from uuid import uuid4
+
+from flask import _request_ctx_stack, g, has_request_context, request
+
+from src.metrics import LOG_DROPPED
+
+
+logger = logging.getLogger('src.requests')
+
+# LogRecord attributes, anything else was passed in extra=.
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    '''One JSON object per record.'''
+
+    def format(self, record):
+
+        line = {
+            'ts': datetime.fromtimestamp(
+                record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and value is not None:
+                line[key] = value
+        if record.exc_info:
+            line['exc'] = self.formatException(record.exc_info)
+
+        return json.dumps(line, default=str)
+
+
+class ContextFilter(logging.Filter):
+    '''Copy the request context onto the record, on the request thread.'''
+
+    def filter(self, record):
+
+        if not has_request_context():
+            return True
+
+        record.request_id = g.get('request_id')
+        record.route = request.endpoint
+        record.method = request.method
+
+        # Only a user already loaded, logging never queries.
+        user = getattr(_request_ctx_stack.top, 'user', None)
+        record.user_id = getattr(user, 'id', None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    '''At most `burst` records per second per logger and message.'''
+
+    def __init__(self, burst: int):
+
+        super(SamplingFilter, self).__init__()
+        self.burst = burst
+        self._windows = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+
+        if (not self.burst or record.levelno >= logging.CRITICAL
+                or record.name == logger.name):  # One per request anyway.
+            return True
+
+        key = (record.name, record.msg)
+        second = int(monotonic())
+        with self._lock:
+            window, count, suppressed = self._windows.get(key, (second, 0, 0))
+            if window != second:
+                window, count = second, 0
+            count += 1
+            if count > self.burst:
+                self._windows[key] = (window, count, suppressed + 1)
+                LOG_DROPPED.inc('sampled')
+                return False
+            self._windows[key] = (window, count, 0)
+
+            # Bounded by the distinct messages of the code base.
+            if len(self._windows) > 10000:
+                self._windows.clear()
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class AsyncHandler(QueueHandler):
+    '''QueueHandler that drops instead of blocking when the queue is full.'''
+
+    def __init__(self, logs):
+
+        super(AsyncHandler, self).__init__(Queue(logs.queue_size))
+        self.logs = logs
+
+    def prepare(self, record):
+
+        # Formatted on the listener thread, only the message is
+        # rendered now, while its arguments are unchanged.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+
+        if self.logs.pid != os.getpid():
+            self.logs.start()
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            LOG_DROPPED.inc('queue_full')
+
+
+class Logs:
+    '''Logging setup and request logging.'''
+
+    def __init__(self, app=None):
+
+        self.app = None
+        self.output = None
+        self.queue_size = 10000
+        self.slow = 1.0
+        self.requests = False
+        self.handler = None
+        self.listener = None
+        self.pid = None
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.queue_size = app.config.get('LOG_QUEUE_SIZE', self.queue_size)
+        self.slow = app.config.get('LOG_SLOW_REQUEST_MS', 1000) / 1000
+        self.requests = app.config.get('LOG_REQUESTS', self.requests)
+        app.extensions['logs'] = self
+
+        self.configure(app.config)
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        atexit.register(self.stop)
+
+    def configure(self, config):
+        '''Route the root logger through the queue, set module levels.'''
+
+        if config.get('LOG_FORMAT', 'json') == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(
+                '%(asctime)s %(levelname)s %(name)s %(message)s')
+
+        self.output = logging.StreamHandler(sys.stdout)
+        self.output.setFormatter(formatter)
+
+        self.stop()
+        self.handler = AsyncHandler(self)
+        self.handler.addFilter(SamplingFilter(
+            config.get('LOG_SAMPLE_BURST', 20)))
+        self.handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if isinstance(
+                h, AsyncHandler)]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(config.get('LOG_LEVEL', 'INFO').upper())
+
+        for item in (config.get('LOG_LEVELS') or '').split(','):
+            if '=' in item:
+                name, level = item.split('=', 1)
+                logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    def start(self):
+        '''Start the listener of this process, after a fork too.'''
+
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            # Never reuse the queue, its lock may be held by a thread
+            # of the process we forked from.
+            self.handler.queue = Queue(self.queue_size)
+            self.listener = QueueListener(
+                self.handler.queue, self.output, respect_handler_level=True)
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def stop(self):
+        '''Write the queued records and stop the listener.'''
+
+        with self._lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+    def start_request(self):
+
+        request.environ['logs.start'] = perf_counter()
+        g.request_id = request.headers.get('X-Request-ID') or uuid4().hex
+
+    def end_request(self, response):
+
+        start = request.environ.get('logs.start')
+        if start is None:  # An earlier before_request handler failed.
+            return response
+
+        response.headers['X-Request-ID'] = g.request_id
+        seconds = perf_counter() - start
+        if self.requests or seconds >= self.slow:
+            logger.log(
+                logging.WARNING if seconds >= self.slow else logging.INFO,
+                '%s %s %s', request.method, request.path,
+                response.status_code,
+                extra={'status': response.status_code,
+                       'duration_ms': round(seconds * 1000, 2)}
+            )
+        return response
+
+
+logs = Logs()
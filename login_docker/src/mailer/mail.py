@@ -1,19 +1,24 @@
-from threading import Thread
+from flask_mail import Message
+from flask import current_app, render_template, url_for
+from markupsafe import escape
 
-from flask_mail import Message, Mail
-from flask import render_template, url_for
-
-from server import app
 from src.login.models import UserToken
+from src.mailer.outbox import outbox
+
+
+# Stands in for the link while the mail skeleton is rendered.
+URI_SLOT = '__MAIL_URI__'
 
 
 class MailBody(Message):
     '''Email body.'''
 
+    # Rendered mail_layout.jinja2 per mail class, built once per process.
+    skeletons = {}
+
     def __init__(self):
-        
-        app.config.from_object('src.config.MailerConfig')
-        super(MailBody, self).__init__(sender=app.config['SENDER'])
+
+        super(MailBody, self).__init__(sender=outbox.sender)
         self.set_message()
 
     def set_message(self):
@@ -21,7 +26,7 @@ class MailBody(Message):
 
         self.subject = self.SUBJECT
         self.recipients = [self.email]
-        self.token = UserToken.create(email=self.email)
+        self.token = UserToken.create(email=self.email, purpose=self.PURPOSE)
 
         # Construct url for email purpose (confirm, change passw.)
         self.route_url = url_for(
@@ -29,24 +34,27 @@ class MailBody(Message):
         )
         self.html = self.get_html()
 
-        # Attach the logo to the mail.
-        self.attach(
-            'logo.png',
-            'image/png',
-            open('src/static/dist/img/logo.png', 'rb').read(),
-            'inline',
-            headers=[['Content-ID', '<logo>'], ]
-        )
+    @classmethod
+    def get_skeleton(cls):
+        '''Mail html with URI_SLOT in place of the link.'''
+
+        skeleton = MailBody.skeletons.get(cls)
+        if skeleton is None or current_app.debug:
+            skeleton = render_template(
+                'mail_layout.jinja2',
+                text=cls.MAIL_TXT,
+                uri=URI_SLOT,
+                action_text=cls.ACTION_TXT
+            )
+            MailBody.skeletons[cls] = skeleton
+
+        return skeleton
 
     def get_html(self):
-        '''Render html for mail body.'''
+        '''Html for mail body.'''
 
-        return render_template(
-            'mail_layout.jinja2',
-            text=self.MAIL_TXT,
-            uri=self.route_url,
-            action_text=self.ACTION_TXT
-        )
+        return self.get_skeleton().replace(
+            URI_SLOT, str(escape(self.route_url)))
 
 
 class ResetMail(MailBody):
@@ -55,6 +63,7 @@ class ResetMail(MailBody):
     SUBJECT = 'Reset your password!'
     MAIL_TXT = 'reset your password'
     ROUTE_ID = 'auth_bp.recover'
+    PURPOSE = 'recover'
     ACTION_TXT = 'Reset'
 
     def __init__(self, email: str):
@@ -69,6 +78,7 @@ class ConfirmMail(MailBody):
     SUBJECT = 'Confirm your account!'
     MAIL_TXT = 'confrim your account'
     ROUTE_ID = 'auth_bp.confirm'
+    PURPOSE = 'confirm'
     ACTION_TXT = 'Confirm'
 
     def __init__(self, email: str):
@@ -82,17 +92,10 @@ class Mailer:
 
     def __init__(self, msg: Message):
 
-        self.mailer = Mail(app=app)
-        self.mailer.init_app(app)
         self.msg = msg
 
-    def send_async(self):
-
-        with app.app_context():
-            self.mailer.send(self.msg)
-
     def send(self):
 
-        # Start a thread for mail sending,
-        # do not block the main thread with it.
-        Thread(target=self.send_async).start()
+        # Queue the mail in the outbox, the dispatcher delivers it
+        # once the current transaction commits.
+        outbox.put(self.msg)
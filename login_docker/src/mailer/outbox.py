@@ -0,0 +1,341 @@
+'''
+Persistent mail outbox.
+
+Mails are written to the mail_outbox table in the same transaction as
+the user change that triggers them, and delivered in batches by a
+long-lived dispatcher over a reused SMTP connection.
+'''
+
+import datetime
+import logging
+import smtplib
+from functools import lru_cache
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from flask.cli import AppGroup
+from flask_mail import Attachment, Mail, Message
+from sqlalchemy import event
+
+from src import db
+from src.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+LOGO_PATH = 'src/static/dist/img/logo.png'
+
+
+@lru_cache(maxsize=None)
+def logo():
+    '''Inline logo attachment, read once per process.'''
+
+    with open(LOGO_PATH, 'rb') as f:
+        return Attachment(
+            'logo.png',
+            'image/png',
+            f.read(),
+            'inline',
+            headers=[['Content-ID', '<logo>'], ]
+        )
+
+
+class OutboxMail(db.Model):
+    '''Queued mail.'''
+
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        db.Index('ix_mail_outbox_pending', 'status', 'next_attempt'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True
+    )
+    sender = db.Column(
+        db.String(120),
+        nullable=True
+    )
+    recipients = db.Column(
+        db.String(400),
+        nullable=False
+    )
+    subject = db.Column(
+        db.String(200),
+        nullable=False
+    )
+    html = db.Column(
+        db.Text,
+        nullable=False
+    )
+    status = db.Column(
+        db.String(10),
+        nullable=False,
+        default='pending'
+    )
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+    next_attempt = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow
+    )
+    last_error = db.Column(
+        db.String(400),
+        nullable=True
+    )
+    created = db.Column(
+        db.DateTime,
+        nullable=True,
+        default=db.func.now()
+    )
+    sent = db.Column(
+        db.DateTime,
+        nullable=True
+    )
+
+    def message(self):
+        '''Build the flask-mail message for delivery.'''
+
+        msg = Message(
+            subject=self.subject,
+            sender=self.sender,
+            recipients=self.recipients.split(','),
+            html=self.html
+        )
+
+        # Attach the logo to the mail.
+        msg.attachments.append(logo())
+        return msg
+
+    def __repr__(self):
+
+        return '<OutboxMail {} {}>'.format(self.id, self.status)
+
+
+class MailDispatcher(Thread):
+    '''Deliver pending outbox mail in batches.'''
+
+    def __init__(self, app, mail: Mail):
+
+        super(MailDispatcher, self).__init__(
+            name='mail-dispatcher', daemon=True)
+        self.app = app
+        self.mail = mail
+        self.batch_size = app.config['MAIL_BATCH_SIZE']
+        self.poll_interval = app.config['MAIL_POLL_INTERVAL']
+        self.idle_timeout = app.config['MAIL_IDLE_TIMEOUT']
+        self.max_attempts = app.config['MAIL_MAX_ATTEMPTS']
+        self.backoff = app.config['MAIL_RETRY_BACKOFF']
+
+        self.drain = True
+        self._wake = Event()
+        self._stopping = Event()
+        self._conn = None
+        self._last_used = 0
+
+    def wake(self):
+        '''Dispatch right away instead of at the next poll.'''
+
+        self._wake.set()
+
+    def stop(self, drain: bool = True, timeout: float = 10):
+        '''Stop the dispatcher, sending what is due first if drain.'''
+
+        self.drain = drain
+        self._stopping.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    sent = self.dispatch()
+                except Exception:
+                    logger.exception('Mail dispatch failed.')
+                    sent = 0
+
+                # A full batch means more may be waiting.
+                if sent >= self.batch_size:
+                    continue
+
+                self.close_idle()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+            while self.drain and self.dispatch():
+                pass
+            self.close()
+
+    def dispatch(self):
+        '''Send up to one batch of due mail, return how many were tried.'''
+
+        tried = 0
+        try:
+            while tried < self.batch_size:
+                row = OutboxMail.query.filter(
+                    OutboxMail.status == 'pending',
+                    OutboxMail.next_attempt <= datetime.datetime.utcnow()
+                ).order_by(
+                    OutboxMail.id
+                ).limit(
+                    1
+                ).with_for_update(
+                    skip_locked=True
+                ).first()
+                if row is None:
+                    break
+
+                self.deliver(row)
+                # Committed per mail: a later failure never re-sends it.
+                db.session.commit()
+                tried += 1
+
+            return tried
+        finally:
+            db.session.remove()
+
+    def deliver(self, row: OutboxMail):
+        '''Send one mail, scheduling a retry with backoff on failure.'''
+
+        try:
+            self.connection().send(row.message())
+        except Exception as e:
+            # Bad address or template included, the row must not block
+            # the queue. Drop the connection, it may be broken.
+            self.close()
+            row.attempts += 1
+            row.last_error = str(e)[:400]
+            if row.attempts >= self.max_attempts:
+                row.status = 'failed'
+                logger.error('Giving up on mail %s: %s', row.id, e)
+            else:
+                delay = min(self.backoff * 2 ** (row.attempts - 1), 3600)
+                row.next_attempt = (
+                    datetime.datetime.utcnow()
+                    + datetime.timedelta(seconds=delay)
+                )
+            return
+
+        row.status = 'sent'
+        row.sent = datetime.datetime.utcnow()
+        self._last_used = monotonic()
+
+    def connection(self):
+        '''Open SMTP connection, reused between batches.'''
+
+        if self._conn is None:
+            conn = self.mail.connect()
+            conn.__enter__()
+            self._conn = conn
+        return self._conn
+
+    def close_idle(self):
+
+        if self._conn and monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def close(self):
+
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+class Outbox:
+    '''Mail outbox extension.'''
+
+    def __init__(self, app=None):
+
+        self.app = None
+        self.sender = None
+        self.mail = Mail()
+        self.dispatcher = None
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.sender = app.config.get('SENDER')
+        self.mail.init_app(app)
+        app.extensions['outbox'] = self
+        app.cli.add_command(mail_cli)
+        metrics.scrape_collector(self.collect)
+
+        if app.config['MAIL_DISPATCHER'] == 'thread':
+            # Started in each worker, after gunicorn forked it.
+            app.before_first_request(self.start)
+
+        if not event.contains(db.session, 'after_commit', self._committed):
+            event.listen(db.session, 'after_commit', self._committed)
+            event.listen(db.session, 'after_rollback', self._rolled_back)
+
+    def collect(self):
+        '''Samples for the metrics endpoint.'''
+
+        pending = OutboxMail.query.filter_by(status='pending').count()
+        return [
+            ('mail_outbox_pending', 'gauge',
+             'Mails waiting in the outbox.', pending),
+        ]
+
+    def put(self, msg: Message):
+        '''Queue a message, sent once the current transaction commits.'''
+
+        db.session.add(OutboxMail(
+            sender=msg.sender,
+            recipients=','.join(msg.recipients),
+            subject=msg.subject,
+            html=msg.html
+        ))
+        db.session.info['outbox_wake'] = True
+
+    def start(self):
+        '''Start the dispatcher thread of this process.'''
+
+        with self._lock:
+            if self.dispatcher is None or not self.dispatcher.is_alive():
+                self.dispatcher = MailDispatcher(self.app, self.mail)
+                self.dispatcher.start()
+
+    def stop(self, drain: bool = True, timeout: float = 10):
+
+        if self.dispatcher is not None:
+            self.dispatcher.stop(drain=drain, timeout=timeout)
+
+    def _committed(self, session):
+
+        if session.info.pop('outbox_wake', False) and self.dispatcher:
+            self.dispatcher.wake()
+
+    def _rolled_back(self, session):
+
+        session.info.pop('outbox_wake', None)
+
+
+outbox = Outbox()
+mail_cli = AppGroup('mail', help='Mail outbox commands.')
+
+
+@mail_cli.command('dispatch')
+def dispatch():
+    '''Run a dispatcher in the foreground (MAIL_DISPATCHER=off).'''
+
+    outbox.start()
+    try:
+        while outbox.dispatcher.is_alive():
+            outbox.dispatcher.join(1)
+    except KeyboardInterrupt:
+        outbox.stop()
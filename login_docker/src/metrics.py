@@ -0,0 +1,498 @@
+'''
+Prometheus-style metrics.
+
+Each worker keeps its counters and histograms in memory (a dict update
+under a lock per observation) and a background thread writes them to
+METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL seconds. /metrics
+sums the files of every worker, past and present, and renders the
+Prometheus text format. Counters of exited workers are folded into
+METRICS_DIR/retired.json and their files deleted, so however often
+workers are recycled (max_requests) the directory holds one file per
+live worker, plus that one.
+'''
+
+import fcntl
+import json
+import os
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Cumulative counters and histograms of exited workers.
+RETIRED = 'retired.json'
+
+LATENCY_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    '''Monotonic counter.'''
+
+    TYPE = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames=()):
+
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *labels, amount: float = 1):
+
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Histogram:
+    '''Cumulative histogram, rendered with _bucket, _sum and _count.'''
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labels):
+
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+
+        with self._lock:
+            return [
+                [list(k), [list(v[0]), v[1], v[2]]]
+                for k, v in self._values.items()
+            ]
+
+
+class Metrics:
+    '''Metrics registry and /metrics endpoint.'''
+
+    def __init__(self, app=None):
+
+        self.app = None
+        self.enabled = True
+        self.directory = None
+        self.interval = 10
+        self._metrics = []
+        self._worker_collectors = []
+        self._scrape_collectors = []
+        self._thread = None
+        self._pid = None
+        self._stopping = Event()
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.enabled = app.config.get('METRICS', self.enabled)
+        self.directory = app.config.get('METRICS_DIR')
+        self.interval = app.config.get('METRICS_FLUSH_INTERVAL', self.interval)
+        app.extensions['metrics'] = self
+
+        if not self.enabled:
+            return
+
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        app.teardown_request(self.failed_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+        if not event.contains(Engine, 'before_cursor_execute', count_query):
+            event.listen(Engine, 'before_cursor_execute', count_query)
+
+    def counter(self, name: str, help: str, labelnames=()):
+
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames=(), **kwargs):
+
+        metric = Histogram(name, help, labelnames, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def worker_collector(self, fn):
+        '''
+        Register fn() -> [(name, type, help, value)] sampled per worker.
+
+        Counters are summed over every worker, gauges over live ones.
+        '''
+
+        self._worker_collectors.append(fn)
+        return fn
+
+    def scrape_collector(self, fn):
+        '''Register fn() -> [(name, type, help, value)] sampled on scrape.'''
+
+        self._scrape_collectors.append(fn)
+        return fn
+
+    def start_request(self):
+
+        request.environ['metrics.start'] = perf_counter()
+
+        # Started lazily, after gunicorn forked the worker.
+        if self._pid != os.getpid():
+            self.start()
+
+    def end_request(self, response):
+
+        self.observe_request(str(response.status_code))
+        return response
+
+    def failed_request(self, exc):
+
+        if exc is not None:
+            self.observe_request('500')
+
+    def observe_request(self, status: str):
+
+        req = request._get_current_object()
+        start = req.environ.pop('metrics.start', None)
+        if start is not None:
+            REQUEST_SECONDS.observe(
+                perf_counter() - start,
+                req.endpoint or 'none',
+                req.method,
+                status
+            )
+
+    def start(self):
+        '''Start the snapshot thread of this process.'''
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = Thread(
+                target=self.run, name='metrics', daemon=True)
+            self._thread.start()
+
+    def run(self):
+
+        while not self._stopping.wait(self.interval):
+            self.write_snapshot()
+
+    def stop(self):
+        '''Write a last snapshot, so counters outlive a recycled worker.'''
+
+        self._stopping.set()
+        if self._pid == os.getpid():
+            self.write_snapshot()
+
+    def clear(self):
+        '''Remove the snapshots of a previous run of the service.'''
+
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+    def retire(self):
+        '''Fold the snapshots of exited workers into RETIRED, delete them.'''
+
+        # Files are named after the pid, the common case reads nothing.
+        if all(pid_alive(int(name[:-len('.json')]))
+               for name in os.listdir(self.directory)
+               if name.endswith('.json') and name != RETIRED
+               and name[:-len('.json')].isdigit()):
+            return
+
+        retired_path = os.path.join(self.directory, RETIRED)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            # One worker folds at a time, the others wait and find
+            # nothing left to fold.
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            retired = read_snapshot(retired_path) or {
+                'pid': None, 'metrics': [], 'folded': []}
+            # Already counted by a fold interrupted before deleting them.
+            for name in retired['folded']:
+                remove(os.path.join(self.directory, name))
+
+            merged, folded = {}, []
+            merge_snapshot(merged, retired['metrics'], alive=False)
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith('.json') or name == RETIRED:
+                    continue
+                snapshot = read_snapshot(os.path.join(self.directory, name))
+                if snapshot is None or pid_alive(snapshot['pid']):
+                    continue
+                merge_snapshot(merged, snapshot['metrics'], alive=False)
+                folded.append(name)
+
+            if not folded:
+                return
+
+            with open(retired_path + '.tmp', 'w') as f:
+                json.dump({
+                    'pid': None,
+                    'metrics': [
+                        dict(m, samples=[
+                            [list(k), v] for k, v in m['samples'].items()])
+                        for m in merged.values()
+                    ],
+                    'folded': folded
+                }, f)
+            os.replace(retired_path + '.tmp', retired_path)
+
+            for name in folded:
+                remove(os.path.join(self.directory, name))
+
+    def snapshot(self):
+        '''Current values of this worker.'''
+
+        metrics = [{
+            'name': m.name,
+            'type': m.TYPE,
+            'help': m.help,
+            'labelnames': list(m.labelnames),
+            'buckets': list(getattr(m, 'buckets', ())),
+            'samples': m.samples()
+        } for m in self._metrics]
+
+        for collector in self._worker_collectors:
+            for name, type_, help, value in collector():
+                metrics.append({
+                    'name': name,
+                    'type': type_,
+                    'help': help,
+                    'labelnames': [],
+                    'buckets': [],
+                    'samples': [[[], value]]
+                })
+
+        return {'pid': os.getpid(), 'metrics': metrics}
+
+    def write_snapshot(self):
+
+        path = os.path.join(self.directory, '{}.json'.format(os.getpid()))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def aggregate(self):
+        '''Merge the snapshots of every worker.'''
+
+        self.retire()
+
+        merged = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            snapshot = read_snapshot(os.path.join(self.directory, name))
+            if snapshot is not None:
+                merge_snapshot(
+                    merged, snapshot['metrics'], pid_alive(snapshot['pid']))
+
+        return merged
+
+    def view(self):
+        '''[GET] Metrics of all workers in Prometheus text format.'''
+
+        self.write_snapshot()
+        merged = self.aggregate()
+        for collector in self._scrape_collectors:
+            for name, type_, help, value in collector():
+                merged[name] = {
+                    'name': name,
+                    'type': type_,
+                    'help': help,
+                    'labelnames': [],
+                    'samples': {(): value}
+                }
+
+        return Response(
+            render(merged.values()),
+            mimetype='text/plain; version=0.0.4'
+        )
+
+
+def read_snapshot(path: str):
+    '''Snapshot of a file, or None if gone or being replaced.'''
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove(path: str):
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def merge_snapshot(merged: dict, metrics: list, alive: bool):
+    '''Add the metrics of a snapshot, gauges only of a live worker.'''
+
+    for metric in metrics:
+        if metric['type'] == 'gauge' and not alive:
+            continue
+
+        into = merged.setdefault(metric['name'], dict(metric, samples={}))
+        for labels, value in metric['samples']:
+            key = tuple(labels)
+            if metric['type'] == 'histogram':
+                value = merge_histogram(into['samples'].get(key), value)
+            else:
+                value += into['samples'].get(key, 0)
+            into['samples'][key] = value
+
+
+def pid_alive(pid: int):
+
+    if pid is None:  # RETIRED.
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_histogram(into, value):
+
+    if into is None:
+        return [list(value[0]), value[1], value[2]]
+
+    return [
+        [a + b for a, b in zip(into[0], value[0])],
+        into[1] + value[1],
+        into[2] + value[2]
+    ]
+
+
+def format_labels(names, values, extra=()):
+
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in pairs
+    ) + '}'
+
+
+def render(metrics):
+    '''Prometheus text exposition format.'''
+
+    lines = []
+    for metric in sorted(metrics, key=lambda m: m['name']):
+        name = metric['name']
+        lines.append('# HELP {} {}'.format(name, metric['help']))
+        lines.append('# TYPE {} {}'.format(name, metric['type']))
+
+        for labels, value in sorted(metric['samples'].items()):
+            if metric['type'] != 'histogram':
+                lines.append('{}{} {}'.format(
+                    name, format_labels(metric['labelnames'], labels), value))
+                continue
+
+            counts, total, count = value
+            cumulative = 0
+            bounds = [str(b) for b in metric['buckets']] + ['+Inf']
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                lines.append('{}_bucket{} {}'.format(
+                    name,
+                    format_labels(
+                        metric['labelnames'], labels, [('le', bound)]),
+                    cumulative
+                ))
+            labels = format_labels(metric['labelnames'], labels)
+            lines.append('{}_sum{} {}'.format(name, labels, total))
+            lines.append('{}_count{} {}'.format(name, labels, count))
+
+    return '\n'.join(lines) + '\n'
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+
+    DB_QUERIES.inc()
+
+
+metrics = Metrics()
+
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds',
+    'Request latency by endpoint, method and status.',
+    ['endpoint', 'method', 'status']
+)
+DB_QUERIES = metrics.counter(
+    'db_queries_total',
+    'SQL statements executed.'
+)
+HASH_SECONDS = metrics.histogram(
+    'password_hash_seconds',
+    'Password hashing time, including the wait for a pool slot.',
+    ['op']
+)
+TOKEN_FAILURES = metrics.counter(
+    'token_verify_failures_total',
+    'UserToken verifications that failed.',
+    ['reason']
+)
+SWEEP_ROWS = metrics.counter(
+    'sweeper_rows_deleted_total',
+    'Expired rows and keys removed by the sweeper.',
+    ['task']
+)
+SWEEP_RUNS = metrics.counter(
+    'sweeper_runs_total',
+    'Sweep task runs by outcome.',
+    ['task', 'status']
+)
+SWEEP_SECONDS = metrics.histogram(
+    'sweeper_run_seconds',
+    'Sweep task duration, pauses between batches included.',
+    ['task'],
+    buckets=(.1, 1, 10, 60, 300, 900, 3600)
+)
+LOG_DROPPED = metrics.counter(
+    'log_records_dropped_total',
+    'Log records sampled out or dropped on a full queue.',
+    ['reason']
+)
+SOCIAL_FAILURES = metrics.counter(
+    'social_provider_failures_total',
+    'Social login provider calls that failed or were refused.',
+    ['provider', 'reason']
+)
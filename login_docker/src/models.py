@@ -1,15 +1,21 @@
 '''User & Database models.'''
 
 import datetime
+import logging
 import string
 import random
 
-from flask import flash
+from flask import flash, g
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-import jwt
+from sqlalchemy.orm import validates
 
-from src import db
+from src import db, hasher, replicas, user_cache
+
+
+logger = logging.getLogger(__name__)
+
+# Marks an email looked up in this request that has no user.
+ABSENT = object()
 
 
 class User(UserMixin, db.Model):
@@ -31,6 +37,12 @@ class User(UserMixin, db.Model):
         unique=True,
         nullable=False
     )
+    # Added to existing databases by the users_email_key schema step.
+    email_key = db.Column(
+        db.String(40),
+        unique=True,
+        nullable=False
+    )
     password = db.Column(
         db.String(200),
         primary_key=False,
@@ -58,16 +70,56 @@ class User(UserMixin, db.Model):
         db.Boolean,
         default=False
     )
+    # Added to existing databases by the users_session_version step, with
+    # a server default for rows inserted by workers not upgraded yet.
+    session_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0'
+    )
+    signup = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false()
+    )
+
+    @validates('email')
+    def set_email_key(self, key, email):
+        '''Keep the case-normalized lookup column in sync.'''
+
+        self.email_key = User.normalize(email)
+        return email
 
     def set_password(self, password):
         '''Set hashed password.'''
 
-        self.password = generate_password_hash(password, method='sha256')
+        self.password = hasher.generate(password)
 
     def check_password(self, password):
         '''Validate password.'''
 
-        return check_password_hash(self.password, password)
+        return hasher.check(self.password, password)
+
+    def rehash_password(self, password):
+        '''Re-hash a verified password stored with an outdated method.'''
+
+        if not hasher.needs_rehash(self.password):
+            return False
+
+        self.set_password(password)
+        return True
+
+    def revoke_sessions(self):
+        '''Invalidate the session claims of every logged in session.'''
+
+        self.session_version = (self.session_version or 0) + 1
+
+    def get_row(self):
+        '''Database row for routes that change the user.'''
+
+        return self
 
     def set_last_login(self,):
         '''Set last login to current time.'''
@@ -80,19 +132,51 @@ class User(UserMixin, db.Model):
         return self.last_login.strftime('%d %b %Y - %H:%M:%S')
 
     @staticmethod
-    def exist(email: str):
-        '''If user exists.'''
+    def normalize(email: str):
+        '''Case-normalized email used for lookups.'''
+
+        return email.strip().lower()
 
-        if User.get(email=email):
-            return True
+    @staticmethod
+    def lookup(email: str, replica: bool = False):
+        '''
+        Get user by email, or None.
+
+        Runs at most one query per email and request, misses are
+        remembered with the ABSENT marker. Read-only callers pass
+        replica=True to allow a read replica.
+        '''
+
+        key = User.normalize(email)
+        found = g.setdefault('user_lookups', {})
+
+        user = found.get(key)
+        if user is None:
+            if replica:
+                with replicas.reading():
+                    user = User.query.filter_by(email_key=key).first()
+            else:
+                user = User.query.filter_by(email_key=key).first()
+            found[key] = user or ABSENT
+            user = found[key]
+
+        if user is ABSENT:
+            return None
+        return user
+
+    @staticmethod
+    def remember(user, email_key: str = None):
+        '''Record a created or deleted user for later lookups.'''
 
-        return False
+        found = g.setdefault('user_lookups', {})
+        found[email_key or user.email_key] = user
 
     @staticmethod
-    def get(email: str):
-        '''Get user.'''
+    def forget(user):
+        '''Record a deleted user as absent for later lookups.'''
 
-        return User.query.filter_by(email=email).first()
+        found = g.setdefault('user_lookups', {})
+        found[user.email_key] = ABSENT
 
     def __repr__(self):
 
@@ -107,7 +191,9 @@ class CreateUser:
     def __init__(self, email: str):
         self.email = email
 
-    def create(self, name: str, login_type: str, password: str = ''):
+    def create(
+            self, name: str, login_type: str,
+            password: str = '', commit: bool = True, signup: bool = False):
 
         confirmed = False
         if login_type in self.LOGIN_TYPES:
@@ -120,25 +206,34 @@ class CreateUser:
             name=name,
             email=self.email,
             login_type=login_type,
-            confirmed=confirmed
+            confirmed=confirmed,
+            signup=signup
         )
         self.user.set_password(password=password)
         self.user.set_last_login()
 
         db.session.add(self.user)
-        self.commit_db()
+        if commit:
+            self.commit_db()
         return self.user
 
     def commit_db(self):
         '''Commit db.'''
 
         try:
+            # Read the id and key before commit expires them, so nothing
+            # has to SELECT the new row again.
+            db.session.flush()
+            user_id, email_key = self.user.id, self.user.email_key
             db.session.commit()
-        except Exception as e:
-            print(e)
+        except Exception:
+            logger.exception('Creating user failed.')
+            db.session.rollback()
             flash('An error happened, please try again!')
             return False
 
+        User.remember(self.user, email_key)
+        user_cache.invalidate(user_id)
         return True
 
     @staticmethod
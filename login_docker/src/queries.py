@@ -0,0 +1,204 @@
+'''
+Per-request SQL query counting and query budgets.
+
+Every statement sent through a SQLAlchemy engine is counted, by verb
+(SELECT, INSERT, ...), together with its execution time, for each
+tracker active on the current thread: one per request, plus any opened
+with expect_queries(). In debug mode the totals of a request are sent
+back in the X-Query-Count and X-Query-Time headers.
+
+Views declare what they are allowed to run with @query_budget, which is
+enforced when testing (or with QUERY_BUDGETS), so a double lookup or an
+extra commit fails CI instead of going unnoticed in review:
+
+    @auth_bp.route('/login', methods=['GET', 'POST'])
+    @query_budget('POST', SELECT=1)
+    def login(): ...
+
+    with expect_queries(SELECT=1, INSERT=0):
+        client.post('/login', data=...)
+'''
+
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    '''More queries ran than the budget allows.'''
+
+
+class QueryStats:
+    '''Statements and DB time seen by one tracker.'''
+
+    def __init__(self):
+
+        self.count = 0
+        self.seconds = 0.0
+        self.verbs = {}
+        self.statements = []
+
+    def add(self, statement: str, seconds: float):
+
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        self.count += 1
+        self.seconds += seconds
+        self.verbs[verb] = self.verbs.get(verb, 0) + 1
+        self.statements.append(statement)
+
+    def over(self, limits: dict):
+        '''Limits this tracker exceeded, as {verb: (count, limit)}.'''
+
+        over = {}
+        for verb, limit in limits.items():
+            count = self.count if verb == 'total' else self.verbs.get(verb, 0)
+            if count > limit:
+                over[verb] = (count, limit)
+        return over
+
+    def check(self, limits: dict, where: str):
+        '''Raise QueryBudgetExceeded if a limit was exceeded.'''
+
+        over = self.over(limits)
+        if over:
+            raise QueryBudgetExceeded('{} ran {}:\n  {}'.format(
+                where,
+                ', '.join('{} {} > {}'.format(c, v, l)
+                          for v, (c, l) in sorted(over.items())),
+                '\n  '.join(self.statements)
+            ))
+
+
+def _trackers():
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def before_execute(conn, cursor, statement, parameters, context, executemany):
+
+    if _trackers():
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+
+    stack = _trackers()
+    if not stack:
+        return
+
+    starts = conn.info.get('query_start')
+    seconds = perf_counter() - starts.pop() if starts else 0.0
+    for stats in stack:
+        stats.add(statement, seconds)
+
+
+@contextmanager
+def track_queries():
+    '''Count the statements run on this thread inside the block.'''
+
+    stats = QueryStats()
+    stack = _trackers()
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+
+@contextmanager
+def expect_queries(**limits):
+    '''
+    Test helper, fail if the block runs more statements than allowed.
+
+    Limits are given per verb (SELECT=1, UPDATE=0) or as total=.
+    '''
+
+    with track_queries() as stats:
+        yield stats
+    stats.check(limits, 'Block')
+
+
+def query_budget(*methods, **limits):
+    '''
+    Declare the statements a view may run per request.
+
+    Without methods the budget applies to every method of the view.
+    '''
+
+    def decorator(view):
+
+        budgets = dict(getattr(view, 'query_budgets', {}))
+        for method in methods or ('*',):
+            budgets[method.upper()] = limits
+        view.query_budgets = budgets
+        return view
+
+    return decorator
+
+
+class QueryCounter:
+    '''Track the queries of each request.'''
+
+    def __init__(self, app=None):
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        app.extensions['queries'] = self
+
+        if not event.contains(Engine, 'before_cursor_execute', before_execute):
+            event.listen(Engine, 'before_cursor_execute', before_execute)
+            event.listen(Engine, 'after_cursor_execute', after_execute)
+
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        app.teardown_request(self.teardown_request)
+
+    def start_request(self):
+
+        stats = QueryStats()
+        request.environ['queries.stats'] = stats
+        _trackers().append(stats)
+
+    def end_request(self, response):
+
+        stats = request.environ.get('queries.stats')
+        if stats is None:
+            return response
+
+        app = current_app._get_current_object()
+        if app.debug or app.config.get('QUERY_HEADERS'):
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time'] = '{:.6f}'.format(stats.seconds)
+
+        if app.testing or app.config.get('QUERY_BUDGETS'):
+            view = app.view_functions.get(request.endpoint)
+            budgets = getattr(view, 'query_budgets', {})
+            limits = budgets.get(request.method, budgets.get('*'))
+            if limits is not None:
+                stats.check(limits, '{} {}'.format(
+                    request.method, request.endpoint))
+
+        return response
+
+    def teardown_request(self, exc):
+
+        stats = request.environ.pop('queries.stats', None)
+        stack = _trackers()
+        if stats in stack:
+            stack.remove(stats)
+
+
+queries = QueryCounter()
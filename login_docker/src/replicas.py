@@ -0,0 +1,103 @@
+'''
+Read replica routing.
+
+SQLALCHEMY_REPLICA_URIS lists replicas of the primary database. They
+are registered as SQLAlchemy binds (replica0, replica1, ...) and reads
+made inside replicas.reading() go to one of them; flushes, DML and
+everything else keep going to the primary.
+
+A browser that just wrote (any flush during its request) is pinned to
+the primary for REPLICA_PIN_SECONDS through its session cookie, so it
+reads its own writes while the replicas catch up.
+'''
+
+import random
+from contextlib import contextmanager
+from time import time
+
+from flask import has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+
+PIN_KEY = '_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    '''Session sending reads to the replica chosen by reading().'''
+
+    def get_bind(self, mapper=None, clause=None):
+
+        replica = self.info.get('replica')
+        if (replica is not None and not self._flushing
+                and not isinstance(clause, UpdateBase)):
+            state = get_state(self.app)
+            return state.db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''Flask-SQLAlchemy with RoutingSession sessions.'''
+
+    def create_session(self, options):
+
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    '''Register the replicas and decide when a read may use them.'''
+
+    def __init__(self, app=None, db=None):
+
+        self.db = None
+        self.binds = []
+        self.pin_seconds = 5
+
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+
+        self.db = db
+        self.pin_seconds = app.config.get('REPLICA_PIN_SECONDS', 5)
+        self.binds = []
+
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for i, uri in enumerate(app.config.get('SQLALCHEMY_REPLICA_URIS', [])):
+            key = 'replica{}'.format(i)
+            binds[key] = uri
+            self.binds.append(key)
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        app.extensions['replicas'] = self
+
+        if self.binds and not event.contains(
+                RoutingSession, 'after_flush', self.wrote):
+            event.listen(RoutingSession, 'after_flush', self.wrote)
+
+    def wrote(self, db_session, flush_context):
+        '''Pin the browser that just wrote to the primary.'''
+
+        if has_request_context():
+            session[PIN_KEY] = int(time() + self.pin_seconds)
+
+    def pinned(self):
+
+        return has_request_context() and session.get(PIN_KEY, 0) > time()
+
+    @contextmanager
+    def reading(self):
+        '''Send the reads of the block to a replica, if there is one.'''
+
+        if not self.binds or self.pinned():
+            yield
+            return
+
+        info = self.db.session.info
+        previous = info.get('replica')
+        info['replica'] = random.choice(self.binds)
+        try:
+            yield
+        finally:
+            info['replica'] = previous
@@ -7,7 +7,10 @@ from flask import Blueprint, render_template, redirect, url_for
 from flask_login import current_user, login_required, logout_user
 
 from src.forms import ResignForm
+from src.login import session as claims
 from src.models import db
+from src import user_cache
+from src.queries import query_budget
 
 
 # Blueprint config
@@ -19,6 +22,7 @@ main_bp = Blueprint(
 
 
 @main_bp.route('/', methods=['GET'])
+@query_budget(SELECT=1, INSERT=0, UPDATE=0)
 @login_required
 def main():
     '''Logged in page.'''
@@ -32,6 +36,7 @@ def main():
 
 
 @main_bp.route("/profile")
+@query_budget(SELECT=1, INSERT=0, UPDATE=0)
 @login_required
 def profile():
     '''User profile page.'''
@@ -46,13 +51,19 @@ def profile():
 
 
 @main_bp.route("/delete_profile", methods=['POST'])
+@query_budget(SELECT=1, DELETE=1)
 @login_required
 def delete_profile():
     '''Delete user.'''
 
-    db.session.delete(current_user)
-    db.session.commit()
+    user_id = current_user.id
+    row = current_user.get_row()
+    if row is not None:  # None when deleted since the claims were issued.
+        db.session.delete(row)
+        db.session.commit()
+    user_cache.invalidate(user_id)
     logout_user()
+    claims.clear_claims()
     return redirect(url_for('auth_bp.login'))
 
 
@@ -62,4 +73,5 @@ def logout():
     '''User log out.'''
 
     logout_user()
+    claims.clear_claims()
     return redirect(url_for('auth_bp.login'))
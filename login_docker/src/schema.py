@@ -0,0 +1,284 @@
+'''
+Schema migrations, run once before the workers start.
+
+    flask schema wait       # until the database accepts connections
+    flask schema upgrade    # apply pending steps
+    flask schema status
+
+Steps are applied in order, each once, and recorded in the
+schema_migrations table. They are idempotent, so databases created by
+the old create_all() at startup are upgraded in place. On Postgres the
+upgrade holds an advisory lock, so containers starting together apply
+each step once. Workers never run DDL or introspect the catalog, they
+only check the recorded steps in /readyz.
+'''
+
+import datetime
+import sys
+from time import monotonic, sleep
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from src import db
+from src.models import User
+
+
+# Any constant shared by every upgrade, see pg_advisory_xact_lock.
+LOCK_ID = 7305881
+
+# Rows per statement of the backfills.
+BATCH_SIZE = 1000
+
+STEPS = []
+
+
+def step(fn):
+    '''Register a migration step, applied in definition order.'''
+
+    STEPS.append(fn)
+    return fn
+
+
+def columns(conn, table: str):
+
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+def unique(conn, table: str, column: str):
+    '''If a unique index or constraint is on exactly that column.'''
+
+    inspector = inspect(conn)
+    return any(
+        [column] == u['column_names'] for u in
+        inspector.get_unique_constraints(table)
+        + [i for i in inspector.get_indexes(table) if i['unique']])
+
+
+@step
+def create_tables(conn):
+    '''Tables that do not exist yet.'''
+
+    db.Model.metadata.create_all(bind=conn)
+
+
+@step
+def users_email_key(conn):
+    '''
+    Normalized, unique email lookup column of User.lookup().
+
+    Each part is checked, so databases where the column was added by
+    hand, or only partly, are completed rather than skipped.
+    '''
+
+    if 'email_key' not in columns(conn, 'users'):
+        conn.execute(text(
+            'ALTER TABLE users ADD COLUMN email_key VARCHAR(40)'))
+    # In Python: SQL trim() keeps the tabs and newlines str.strip()
+    # drops, the keys must be those User.lookup() computes.
+    select = text(
+        'SELECT id, email FROM users WHERE email_key IS NULL AND id > :last '
+        'ORDER BY id LIMIT :limit')
+    update = text('UPDATE users SET email_key = :key WHERE id = :id')
+    last = 0
+    while True:
+        rows = conn.execute(select, last=last, limit=BATCH_SIZE).fetchall()
+        if not rows:
+            break
+        conn.execute(update, [
+            {'id': row[0], 'key': User.normalize(row[1])} for row in rows])
+        last = rows[-1][0]
+
+    clashes = [row[0] for row in conn.execute(text(
+        'SELECT email_key FROM users GROUP BY email_key '
+        'HAVING count(*) > 1 LIMIT 10'))]
+    if clashes:
+        # Rolled back with the upgrade, nothing is half applied.
+        raise RuntimeError(
+            'Emails differing only by case or spaces, merge or rename '
+            'those users first: {}'.format(', '.join(clashes)))
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            'ALTER TABLE users ALTER COLUMN email_key SET NOT NULL'))
+    if not unique(conn, 'users', 'email_key'):
+        conn.execute(text(
+            'CREATE UNIQUE INDEX ix_users_email_key ON users (email_key)'))
+
+
+@step
+def users_session_version(conn):
+    '''Counter bumped to revoke session claims, see src/login/session.py.'''
+
+    if 'session_version' not in columns(conn, 'users'):
+        conn.execute(text(
+            'ALTER TABLE users '
+            'ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0'))
+        return
+
+    # Added by hand without the default: rows must still load.
+    conn.execute(text(
+        'UPDATE users SET session_version = 0 WHERE session_version IS NULL'))
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            'ALTER TABLE users ALTER COLUMN session_version SET DEFAULT 0, '
+            'ALTER COLUMN session_version SET NOT NULL'))
+
+
+@step
+def users_unconfirmed(conn):
+    '''Signup flag and partial index of the signups the sweeper deletes.'''
+
+    if 'signup' not in columns(conn, 'users'):
+        conn.execute(text(
+            'ALTER TABLE users '
+            'ADD COLUMN signup BOOLEAN NOT NULL DEFAULT false'))
+        # Imports arrive with this step, every unconfirmed site
+        # account so far came from the signup form.
+        conn.execute(text(
+            "UPDATE users SET signup = true "
+            "WHERE confirmed = false AND login_type = 'site'"))
+
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_users_unconfirmed ON users (id) '
+        "WHERE confirmed = false AND signup = true AND login_type = 'site'"))
+
+
+@step
+def users_admin_indexes(conn):
+    '''Keyset indexes of the admin user listing, see src/admin.py.'''
+
+    for name, index_columns in (
+            ('ix_users_created', 'created, id'),
+            ('ix_users_last_login', 'last_login, id'),
+            ('ix_users_login_type', 'login_type, id')):
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS {} ON users ({})'.format(
+                name, index_columns)))
+
+    if conn.dialect.name == 'postgresql':
+        # Bytewise order, so email prefixes are index ranges whatever
+        # the database collation.
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_users_email_key_c '
+            'ON users (email_key COLLATE "C")'))
+
+
+class Migrations:
+    '''Apply and check the migration steps.'''
+
+    def __init__(self, app=None):
+
+        self.current = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        app.cli.add_command(schema_cli)
+        app.extensions['migrations'] = self
+
+    def pending(self):
+        '''Steps not applied yet.'''
+
+        with db.engine.connect() as conn:
+            try:
+                applied = self.applied(conn)
+            except DBAPIError:  # No schema_migrations table yet.
+                applied = set()
+
+        return [fn.__name__ for fn in STEPS if fn.__name__ not in applied]
+
+    @staticmethod
+    def applied(conn):
+
+        return {row[0] for row in conn.execute(
+            text('SELECT name FROM schema_migrations'))}
+
+    def is_current(self):
+        '''If every step is applied, remembered once true.'''
+
+        if not self.current:
+            self.current = not self.pending()
+        return self.current
+
+    def upgrade(self):
+        '''Apply pending steps in one transaction, return their names.'''
+
+        with db.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text('SET LOCAL statement_timeout = 0'))
+                conn.execute(
+                    text('SELECT pg_advisory_xact_lock(:id)'), id=LOCK_ID)
+
+            conn.execute(text(
+                'CREATE TABLE IF NOT EXISTS schema_migrations ('
+                'name VARCHAR(100) PRIMARY KEY, applied TIMESTAMP NOT NULL)'))
+            applied = self.applied(conn)
+
+            done = []
+            for fn in STEPS:
+                if fn.__name__ in applied:
+                    continue
+                fn(conn)
+                conn.execute(
+                    text('INSERT INTO schema_migrations (name, applied) '
+                         'VALUES (:name, :applied)'),
+                    name=fn.__name__, applied=datetime.datetime.utcnow())
+                done.append(fn.__name__)
+
+        self.current = True
+        return done
+
+    def wait(self, timeout: float = 60):
+        '''Wait for the database to accept connections.'''
+
+        deadline = monotonic() + timeout
+        delay = .1
+        while True:
+            try:
+                with db.engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+                return True
+            except OperationalError:
+                if monotonic() + delay > deadline:
+                    return False
+                sleep(delay)
+                delay = min(delay * 2, 2)
+
+
+migrations = Migrations()
+schema_cli = AppGroup('schema', help='Database schema commands.')
+
+
+@schema_cli.command('wait')
+@click.option('--timeout', default=60.0, help='Seconds to wait.')
+def wait_command(timeout):
+    '''Wait until the database accepts connections.'''
+
+    start = monotonic()
+    if not migrations.wait(timeout):
+        click.echo('Database not reachable after {:.0f}s.'.format(timeout),
+                   err=True)
+        sys.exit(1)
+    click.echo('Database up after {:.1f}s.'.format(monotonic() - start))
+
+
+@schema_cli.command('upgrade')
+def upgrade_command():
+    '''Apply pending migration steps.'''
+
+    done = migrations.upgrade()
+    click.echo('Applied: {}'.format(', '.join(done) if done else 'nothing'))
+
+
+@schema_cli.command('status')
+def status_command():
+    '''List pending migration steps.'''
+
+    pending = migrations.pending()
+    click.echo('Pending: {}'.format(', '.join(pending) if pending else 'nothing'))
+    sys.exit(1 if pending else 0)
@@ -0,0 +1,188 @@
+'''
+Expiring counters and keys shared by all gunicorn workers.
+
+SHARED_STORE selects the backend: 'memory://' for a single process or
+'sqlite:///path/to/file.db' for every worker on the host. Any other
+backend is plugged in with SHARED_STORE_CLASS, an import path of a class
+taking the SHARED_STORE uri and implementing incr/get/add/purge.
+'''
+
+import os
+import sqlite3
+import threading
+from time import time
+
+from werkzeug.utils import import_string
+
+
+class MemoryStore:
+    '''Store local to one process.'''
+
+    def __init__(self, uri: str = 'memory://'):
+
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def incr(self, key: str, ttl: float):
+        '''Increment a counter, starting at 1 once it expired.'''
+
+        now = time()
+        with self._lock:
+            value, expires = self._data.get(key, (0, 0))
+            if expires < now:
+                value, expires = 0, now + ttl
+            self._data[key] = (value + 1, expires)
+            return value + 1
+
+    def get(self, key: str):
+        '''Unexpired value, or None.'''
+
+        value, expires = self._data.get(key, (None, 0))
+        if expires < time():
+            return None
+        return value
+
+    def add(self, key: str, ttl: float):
+        '''Set a key if absent or expired, return whether it was set.'''
+
+        now = time()
+        with self._lock:
+            if self._data.get(key, (None, 0))[1] >= now:
+                return False
+            self._data[key] = (1, now + ttl)
+            return True
+
+    def purge(self):
+        '''Drop expired keys, return how many.'''
+
+        now = time()
+        with self._lock:
+            expired = [k for k, (_, e) in self._data.items() if e < now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+class SQLiteStore:
+    '''Store in a local SQLite file in WAL mode, shared across processes.'''
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS kv (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires);
+    '''
+
+    def __init__(self, uri: str):
+
+        self.path = uri[len('sqlite:///'):]
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def connection(self):
+        '''Connection of the current thread and process.'''
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key: str, ttl: float):
+        '''Increment a counter, starting at 1 once it expired.'''
+
+        now = time()
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                '''
+                INSERT INTO kv (key, value, expires) VALUES (?, 1, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = CASE WHEN expires < ? THEN 1 ELSE value + 1 END,
+                    expires = CASE WHEN expires < ?
+                        THEN excluded.expires ELSE expires END
+                ''',
+                (key, now + ttl, now, now)
+            )
+            value = conn.execute(
+                'SELECT value FROM kv WHERE key = ?', (key,)).fetchone()[0]
+        finally:
+            conn.execute('COMMIT')
+        return value
+
+    def get(self, key: str):
+        '''Unexpired value, or None.'''
+
+        row = self.connection().execute(
+            'SELECT value FROM kv WHERE key = ? AND expires >= ?',
+            (key, time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def add(self, key: str, ttl: float):
+        '''Set a key if absent or expired, return whether it was set.'''
+
+        now = time()
+        cursor = self.connection().execute(
+            '''
+            INSERT INTO kv (key, value, expires) VALUES (?, 1, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = 1, expires = excluded.expires
+            WHERE expires < ?
+            ''',
+            (key, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def purge(self):
+        '''Drop expired keys, return how many.'''
+
+        cursor = self.connection().execute(
+            'DELETE FROM kv WHERE expires < ?', (time(),))
+        return cursor.rowcount
+
+
+class SharedStore:
+    '''Extension holding the configured store backend.'''
+
+    def __init__(self, app=None):
+
+        self.backend = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        uri = app.config['SHARED_STORE']
+        if app.config.get('SHARED_STORE_CLASS'):
+            self.backend = import_string(app.config['SHARED_STORE_CLASS'])(uri)
+        elif uri.startswith('sqlite:///'):
+            self.backend = SQLiteStore(uri)
+        else:
+            self.backend = MemoryStore(uri)
+        app.extensions['store'] = self
+
+    def incr(self, key: str, ttl: float):
+
+        return self.backend.incr(key, ttl)
+
+    def get(self, key: str):
+
+        return self.backend.get(key)
+
+    def add(self, key: str, ttl: float):
+
+        return self.backend.add(key, ttl)
+
+    def purge(self):
+
+        return self.backend.purge()
@@ -0,0 +1,205 @@
+'''
+Background sweeping of expired rows and keys.
+
+Tasks registered with @task run every SWEEP_INTERVAL seconds:
+
+- unconfirmed_users deletes site accounts made by the signup form and
+  not confirmed within SWEEP_UNCONFIRMED_DAYS (never imported or
+  social ones), in id-ordered batches of SWEEP_BATCH_SIZE, each its
+  own short transaction, SWEEP_PAUSE seconds apart;
+- shared_store purges expired throttle counters and spent token ids.
+
+With SWEEPER='thread' each worker runs a sweeper thread and a lock in
+the shared store lets one of them sweep per interval. With 'off', run
+`flask sweep run` in a container of its own, or `flask sweep once`
+from cron. Deleted rows and runs are exposed on /metrics.
+'''
+
+import datetime
+import logging
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+
+from src import db, store, user_cache
+from src.metrics import SWEEP_ROWS, SWEEP_RUNS, SWEEP_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'sweeper:leader'
+
+# Same predicate as the ix_users_unconfirmed partial index.
+UNCONFIRMED = "confirmed = false AND signup = true AND login_type = 'site'"
+
+TASKS = []
+
+
+def task(fn):
+    '''Register a sweep task, fn(sweeper) -> rows removed.'''
+
+    TASKS.append(fn)
+    return fn
+
+
+@task
+def unconfirmed_users(sweeper):
+    '''Site signups never confirmed, deleted in keyset batches.'''
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(
+        days=sweeper.unconfirmed_days)
+    select = text(
+        'SELECT id FROM users WHERE {} AND id > :last AND created < :cutoff '
+        'ORDER BY id LIMIT :limit'.format(UNCONFIRMED))
+    delete = text(
+        'DELETE FROM users WHERE {} AND id IN :ids'.format(UNCONFIRMED)
+    ).bindparams(bindparam('ids', expanding=True))
+
+    last, total = 0, 0
+    while not sweeper.stopping():
+        with db.engine.begin() as conn:
+            ids = [row[0] for row in conn.execute(
+                select, last=last, cutoff=cutoff, limit=sweeper.batch_size)]
+            if not ids:
+                break
+            # Users confirming meanwhile are kept by the predicate.
+            deleted = conn.execute(delete, ids=ids).rowcount
+
+        for user_id in ids:
+            user_cache.invalidate(user_id)
+        SWEEP_ROWS.inc('unconfirmed_users', amount=deleted)
+        total += deleted
+        last = ids[-1]
+
+        if len(ids) < sweeper.batch_size:
+            break
+        sweeper.pause()
+
+    return total
+
+
+@task
+def shared_store(sweeper):
+    '''Expired throttle counters and token ids.'''
+
+    purged = store.purge()
+    SWEEP_ROWS.inc('shared_store', amount=purged)
+    return purged
+
+
+class Sweeper:
+    '''Run the sweep tasks periodically.'''
+
+    def __init__(self, app=None):
+
+        self.app = None
+        self.mode = 'thread'
+        self.interval = 3600
+        self.batch_size = 500
+        self.pause_seconds = .5
+        self.unconfirmed_days = 7
+        self._thread = None
+        self._stopping = Event()
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        self.app = app
+        self.mode = app.config.get('SWEEPER', self.mode)
+        self.interval = app.config.get('SWEEP_INTERVAL', self.interval)
+        self.batch_size = app.config.get('SWEEP_BATCH_SIZE', self.batch_size)
+        self.pause_seconds = app.config.get('SWEEP_PAUSE', self.pause_seconds)
+        self.unconfirmed_days = app.config.get(
+            'SWEEP_UNCONFIRMED_DAYS', self.unconfirmed_days)
+        app.extensions['sweeper'] = self
+        app.cli.add_command(sweep_cli)
+
+        if self.mode == 'thread':
+            # Started in each worker, after gunicorn forked it.
+            app.before_first_request(self.start)
+
+    def start(self):
+        '''Start the sweeper thread of this process.'''
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = Thread(
+                    target=self.run, name='sweeper', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        '''Stop the sweeper after the batch it is deleting.'''
+
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def run(self):
+
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                # One worker per interval, across restarts too.
+                if store.add(LOCK_KEY, self.interval * .9):
+                    self.sweep()
+                self._stopping.wait(self.interval)
+
+    def sweep(self, names=None):
+        '''Run the tasks (all, or those named), return rows per task.'''
+
+        done = {}
+        for fn in TASKS:
+            if names and fn.__name__ not in names:
+                continue
+
+            start = perf_counter()
+            try:
+                done[fn.__name__] = fn(self)
+                SWEEP_RUNS.inc(fn.__name__, 'ok')
+            except Exception:
+                logger.exception('Sweep task %s failed.', fn.__name__)
+                SWEEP_RUNS.inc(fn.__name__, 'error')
+            SWEEP_SECONDS.observe(perf_counter() - start, fn.__name__)
+
+        return done
+
+    def stopping(self):
+
+        return self._stopping.is_set()
+
+    def pause(self):
+        '''Between batches, cut short when stopping.'''
+
+        self._stopping.wait(self.pause_seconds)
+
+
+sweeper = Sweeper()
+sweep_cli = AppGroup('sweep', help='Expired state sweeping commands.')
+
+
+@sweep_cli.command('once')
+@click.option('--task', 'names', multiple=True,
+              type=click.Choice([fn.__name__ for fn in TASKS]),
+              help='Only this task, can be repeated.')
+def once_command(names):
+    '''Run the sweep tasks once.'''
+
+    for name, rows in sweeper.sweep(names).items():
+        click.echo('{}: {} removed'.format(name, rows))
+
+
+@sweep_cli.command('run')
+def run_command():
+    '''Sweep every SWEEP_INTERVAL in the foreground (SWEEPER=off).'''
+
+    click.echo('Sweeping every {:.0f}s.'.format(sweeper.interval))
+    try:
+        sweeper.run()
+    except KeyboardInterrupt:
+        sweeper.stop()
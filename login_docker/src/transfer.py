@@ -0,0 +1,386 @@
+'''
+Bulk user import and export.
+
+    flask users import users.csv            # or .jsonl, '-' for stdin
+    flask users import users.jsonl --hash-iterations 10000
+    flask users export users.csv --since-id 0
+
+Rows are streamed in batches of --batch-size, so memory stays flat
+whatever the file size. Import columns: email, name, and either
+password (hashed here, in a process pool) or password_hash (a werkzeug
+hash, stored as is); optional login_type, confirmed (default true,
+they are existing accounts), created and last_login. Social rows
+('fb', 'google') need no password.
+
+Each batch is one multi-row INSERT skipping emails that already exist
+(ON CONFLICT (email_key) DO NOTHING, OR IGNORE on SQLite), or with
+--copy on Postgres a COPY into a temporary table. Hashing of the next
+batch overlaps the insert of the current one. A lower --hash-iterations
+makes a large import fast; those hashes are upgraded to HASH_ITERATIONS
+at the user's first login, see User.rehash_password.
+'''
+
+import csv
+import datetime
+import io
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import monotonic
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from werkzeug.security import generate_password_hash
+
+from src import db, hasher, replicas
+from src.models import CreateUser, User
+
+
+COLUMNS = (
+    'name', 'email', 'email_key', 'password', 'created', 'last_login',
+    'login_type', 'confirmed', 'session_version', 'signup'
+)
+EXPORT_COLUMNS = (
+    'id', 'email', 'name', 'login_type', 'confirmed', 'created', 'last_login'
+)
+
+EMAIL_LENGTH = User.__table__.c.email.type.length
+
+# Stored for social users, no password ever matches it.
+NO_PASSWORD = '!'
+
+
+def file_format(path: str, fmt: str = None):
+    ''''csv' or 'jsonl', from --format or the file extension.'''
+
+    if fmt:
+        return fmt
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(stream, fmt: str):
+    '''Dicts of a CSV or JSON Lines stream, one at a time.'''
+
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def batches(rows, size: int):
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def parse_bool(value):
+
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    return str(value).strip().lower() in ('1', 'true', 'yes', 't')
+
+
+def parse_confirmed(value):
+    '''Existing accounts are confirmed unless the file says otherwise.'''
+
+    if value is None or value == '':
+        return True
+    return parse_bool(value)
+
+
+def parse_datetime(value):
+
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+
+class UserImport:
+    '''Prepare, hash and insert user rows in batches.'''
+
+    def __init__(self, method: str, workers: int = None,
+                 batch_size: int = 1000, copy: bool = False):
+
+        self.method = method
+        self.batch_size = batch_size
+        self.copy = copy
+        self.executor = ProcessPoolExecutor(workers)
+        self.now = datetime.datetime.now()
+        self.read = self.inserted = self.skipped = 0
+
+    def prepare(self, batch: list):
+        '''(rows, hashes), the hashes still computing in the pool.'''
+
+        rows, plain = [], []
+        for raw in batch:
+            self.read += 1
+            row = self.parse(raw)
+            if row is None:
+                self.skipped += 1
+                continue
+            password = row.pop('plain')
+            if password is not None:
+                plain.append(password)
+            rows.append(row)
+
+        hashes = self.executor.map(
+            generate_password_hash, plain, [self.method] * len(plain),
+            chunksize=max(len(plain) // 32, 1))
+        return rows, hashes
+
+    def parse(self, raw: dict):
+        '''Insert values of a row, or None when it is unusable.'''
+
+        email = (raw.get('email') or '').strip()
+        name = (raw.get('name') or '').strip()
+        if (not email or '@' not in email or not name
+                or len(email) > EMAIL_LENGTH):
+            return None
+
+        login_type = raw.get('login_type') or 'site'
+        social = login_type in CreateUser.LOGIN_TYPES
+        # A blank CSV cell is '', hashed from the password column too.
+        password, plain = raw.get('password_hash') or None, None
+        if password and '$' not in password:
+            return None
+        if not password:
+            if social:
+                password = NO_PASSWORD
+            elif raw.get('password'):
+                plain = raw['password']
+            else:
+                return None
+
+        try:
+            return {
+                'name': name[:100],
+                'email': email,
+                'email_key': User.normalize(email),
+                'password': password,
+                'plain': plain,
+                'created': parse_datetime(raw.get('created')) or self.now,
+                'last_login': parse_datetime(raw.get('last_login')),
+                'login_type': login_type[:10],
+                'confirmed': social or parse_confirmed(raw.get('confirmed')),
+                'session_version': 0,
+                'signup': False,
+            }
+        except ValueError:
+            return None
+
+    def insert(self, conn, rows: list, hashes):
+        '''Insert a prepared batch, skipping existing emails.'''
+
+        hashes = iter(hashes)
+        for row in rows:
+            if row['password'] is None:
+                row['password'] = next(hashes)
+
+        if not rows:
+            return
+        if conn.dialect.name == 'postgresql':
+            if self.copy:
+                inserted = self.copy_rows(conn, rows)
+            else:
+                inserted = conn.execute(
+                    postgresql.insert(User.__table__).values(rows)
+                    .on_conflict_do_nothing(index_elements=['email_key'])
+                ).rowcount
+        else:
+            inserted = conn.execute(
+                User.__table__.insert().prefix_with('OR IGNORE'), rows
+            ).rowcount
+
+        self.inserted += inserted
+        self.skipped += len(rows) - inserted
+
+    @staticmethod
+    def copy_rows(conn, rows: list):
+        '''COPY into a temporary table, then INSERT ... SELECT.'''
+
+        columns = ', '.join(COLUMNS)
+        conn.execute(text(
+            'CREATE TEMPORARY TABLE IF NOT EXISTS users_import '
+            'ON COMMIT DELETE ROWS AS SELECT {} FROM users WITH NO DATA'
+            .format(columns)))
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                '' if row[c] is None else row[c] for c in COLUMNS])
+        buffer.seek(0)
+
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(
+            'COPY users_import ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                columns), buffer)
+
+        return conn.execute(text(
+            'INSERT INTO users ({0}) SELECT {0} FROM users_import '
+            'ON CONFLICT (email_key) DO NOTHING'.format(columns)
+        )).rowcount
+
+    def run(self, rows, progress=None):
+        '''Import every row, one transaction per batch.'''
+
+        pending = None
+        try:
+            for batch in batches(rows, self.batch_size):
+                prepared = self.prepare(batch)
+                if pending is not None:
+                    self.flush(pending, progress)
+                pending = prepared
+            if pending is not None:
+                self.flush(pending, progress)
+        finally:
+            self.executor.shutdown()
+
+    def flush(self, prepared, progress):
+
+        with db.engine.begin() as conn:
+            self.insert(conn, *prepared)
+        if progress is not None:
+            progress(self)
+
+
+def export_rows(batch_size: int = 1000, since_id: int = 0,
+                hashes: bool = False):
+    '''User rows in id order, read in keyset batches from a replica.'''
+
+    table = User.__table__
+    columns = [table.c[c] for c in EXPORT_COLUMNS]
+    if hashes:
+        columns.append(table.c.password)
+
+    last = since_id
+    while True:
+        with replicas.reading():
+            rows = db.session.execute(
+                select(columns).where(table.c.id > last)
+                .order_by(table.c.id).limit(batch_size)
+            ).fetchall()
+        # No transaction held open between batches.
+        db.session.close()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+        last = rows[-1]['id']
+
+
+def write_rows(stream, rows, fmt: str, columns):
+
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+        return
+
+    for row in rows:
+        stream.write(json.dumps(row, default=str))
+        stream.write('\n')
+
+
+class UserTransfer:
+    '''Registers the users CLI.'''
+
+    def __init__(self, app=None):
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+
+        app.cli.add_command(users_cli)
+        app.extensions['transfer'] = self
+
+
+transfer = UserTransfer()
+users_cli = AppGroup('users', help='Bulk user commands.')
+
+
+def rate(count: int, start: float):
+
+    return count / max(monotonic() - start, 1e-9)
+
+
+@users_cli.command('import')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Default: from the file extension.')
+@click.option('--batch-size', default=1000, help='Rows per INSERT.')
+@click.option('--workers', type=int, help='Hashing processes, default: CPUs.')
+@click.option('--hash-iterations', type=int,
+              help='PBKDF2 cost of imported passwords, default: '
+                   'HASH_ITERATIONS. Upgraded at first login.')
+@click.option('--copy', is_flag=True, help='Postgres COPY instead of INSERT.')
+def import_command(path, fmt, batch_size, workers, hash_iterations, copy):
+    '''Import users from a CSV or JSON Lines file, '-' for stdin.'''
+
+    method = hasher.method
+    if hash_iterations:
+        method = 'pbkdf2:sha256:{}'.format(hash_iterations)
+
+    start = monotonic()
+
+    def progress(job):
+        click.echo('{} rows, {:.0f} rows/s'.format(
+            job.read, rate(job.read, start)), err=True)
+
+    job = UserImport(method, workers, batch_size, copy)
+    stream = sys.stdin if path == '-' else open(path, newline='')
+    with stream:
+        job.run(read_rows(stream, file_format(path, fmt)), progress)
+
+    click.echo('Imported {} of {} rows ({} skipped) in {:.1f}s, '
+               '{:.0f} rows/s.'.format(
+                   job.inserted, job.read, job.skipped,
+                   monotonic() - start, rate(job.read, start)))
+
+
+@users_cli.command('export')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Default: from the file extension.')
+@click.option('--batch-size', default=1000, help='Rows per SELECT.')
+@click.option('--since-id', default=0, help='Only users with a larger id.')
+@click.option('--with-hashes', is_flag=True, help='Include password hashes.')
+def export_command(path, fmt, batch_size, since_id, with_hashes):
+    '''Export users to a CSV or JSON Lines file, '-' for stdout.'''
+
+    columns = list(EXPORT_COLUMNS)
+    if with_hashes:
+        columns.append('password')
+
+    start = monotonic()
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    stream = sys.stdout if path == '-' else open(path, 'w', newline='')
+    rows = export_rows(batch_size, since_id, with_hashes)
+    with stream:
+        write_rows(stream, counted(rows), file_format(path, fmt), columns)
+
+    click.echo('Exported {} rows in {:.1f}s, {:.0f} rows/s.'.format(
+        count, monotonic() - start, rate(count, start)), err=True)
@@ -3,4 +3,5 @@
 export FLASK_APP=server.py
 export FLASK_DEBUG=1
 export APP_CONFIG_FILE=config.py
+flask schema upgrade
 flask run
\ No newline at end of file
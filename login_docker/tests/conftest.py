@@ -0,0 +1,92 @@
+'''
+Fixtures: the app on a throwaway SQLite database, in testing mode.
+
+    cd login_docker && python -m pytest tests
+
+With TESTING set every @query_budget is enforced, a view running more
+statements than it declares fails its test.
+'''
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+
+DB_DIR = tempfile.mkdtemp(prefix='login-tests-')
+
+# Read once by src.config, set before the app is imported.
+os.environ.update({
+    'SECRET_KEY': 'test-secret',
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}/test.db'.format(DB_DIR),
+    'SHARED_STORE': 'memory://',
+    'SENDER': 'noreply@example.com',
+    'MAIL_DISPATCHER': 'off',
+    'SWEEPER': 'off',
+    'METRICS': 'false',
+    'HASH_ITERATIONS': '1000',
+    'LOGIN_FLUSH_INTERVAL': '3600',
+    'LOG_LEVEL': 'WARNING',
+})
+
+from src import create_app, db, render_cache, store, user_cache
+from src.login.recorder import recorder
+from src.models import CreateUser
+from src.schema import migrations
+from src.store import MemoryStore
+
+
+@pytest.fixture(scope='session')
+def app():
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        migrations.upgrade()
+    yield app
+    shutil.rmtree(DB_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def clean(app):
+    '''Empty tables, store and caches between tests.'''
+
+    yield
+    recorder.flush()
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        db.session.remove()
+    store.backend = MemoryStore()
+    user_cache.clear()
+    render_cache.clear()
+
+
+@pytest.fixture
+def client(app):
+
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    '''make_user(email, password='secret12', confirmed=True) -> user id.'''
+
+    def make(email, password='secret12', confirmed=True, signup=False):
+        with app.app_context():
+            user = CreateUser(email=email).create(
+                name='Test', login_type='site', password=password,
+                commit=False, signup=signup)
+            user.confirmed = confirmed
+            db.session.commit()
+            return user.id
+
+    return make
+
+
+def login(client, email, password='secret12'):
+
+    return client.post(
+        '/login/', data={'email': email, 'password': password})
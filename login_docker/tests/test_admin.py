@@ -0,0 +1,112 @@
+'''Read-only admin API, see src/admin.py.'''
+
+import datetime
+
+import pytest
+
+from src import db
+from src.models import User
+
+
+TOKEN = 'admin-token'
+
+
+@pytest.fixture
+def admin(app, client, monkeypatch):
+    '''get(**args) -> response of GET /admin/api/users with the token.'''
+
+    monkeypatch.setitem(app.config, 'ADMIN_API_TOKEN', TOKEN)
+
+    def get(**args):
+        return client.get('/admin/api/users', query_string=args,
+                          headers={'Authorization': 'Bearer ' + TOKEN})
+
+    return get
+
+
+def pages(get, **args):
+    '''Every page, following the cursors.'''
+
+    found = []
+    while True:
+        body = get(**args).get_json()
+        found.append(body['users'])
+        if body['next'] is None:
+            return found
+        args['after'] = body['next']
+
+
+def test_hidden_without_a_token(client):
+
+    response = client.get('/admin/api/users')
+    assert response.status_code == 404
+    assert 'error' in response.get_json()
+
+
+def test_bearer_token_required(client, admin):
+
+    assert client.get('/admin/api/users').status_code == 401
+    response = client.get(
+        '/admin/api/users', headers={'Authorization': 'Bearer nope'})
+    assert response.status_code == 401
+    assert response.get_json()['error']
+
+
+def test_pages_by_id(admin, make_user):
+
+    ids = [make_user('{}@example.com'.format(name))
+           for name in ('ann', 'bob', 'cid', 'dan', 'eve')]
+
+    found = pages(admin, limit=2)
+    assert [len(page) for page in found] == [2, 2, 1]
+    assert [user['id'] for page in found for user in page] == ids
+    assert set(found[0][0]) == {
+        'id', 'email', 'name', 'login_type', 'confirmed', 'created',
+        'last_login'}
+
+
+def test_email_prefix_pages_by_email(admin, make_user):
+
+    for email in ('ann2@example.com', 'Ann1@example.com', 'bob@example.com'):
+        make_user(email)
+
+    found = pages(admin, email='ANN', limit=1)
+    assert [page[0]['email'] for page in found] == [
+        'Ann1@example.com', 'ann2@example.com']
+
+
+def test_date_sort_pages_ties_by_id(app, admin, make_user):
+
+    ids = [make_user('{}@example.com'.format(i)) for i in range(4)]
+    with app.app_context():
+        User.query.update({'created': datetime.datetime(2020, 1, 1)})
+        db.session.commit()
+
+    found = pages(admin, created_from='2019-12-31', limit=3)
+    assert [user['id'] for page in found for user in page] == ids
+    assert found[0][0]['created'] == '2020-01-01T00:00:00'
+    assert pages(admin, created_to='2020-01-01') == [[]]
+
+
+@pytest.mark.parametrize('args', [
+    {'sort': 'password'},
+    {'limit': 'all'},
+    {'created_from': 'yesterday'},
+    {'after': 'not-a-cursor'},
+])
+def test_bad_requests(admin, args):
+
+    response = admin(**args)
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+
+def test_cursor_belongs_to_its_sort(admin, make_user):
+
+    for name in ('ann', 'bob'):
+        make_user(name + '@example.com')
+    cursor = admin(limit=1).get_json()['next']
+
+    response = admin(sort='email', after=cursor)
+    assert response.status_code == 400
+    assert 'another sort' in response.get_json()['error']
@@ -0,0 +1,28 @@
+'''Fingerprinted static files, see src/assets.py.'''
+
+import gzip
+import os
+import shutil
+
+from src.assets import BUILD_DIR, STATIC_FOLDER, build
+
+
+def test_build_ships_dist_byte_for_byte(tmp_path):
+
+    static = str(tmp_path / 'static')
+    shutil.copytree(
+        STATIC_FOLDER, static, ignore=shutil.ignore_patterns(BUILD_DIR))
+
+    manifest = build(static)
+
+    dist = os.path.join(STATIC_FOLDER, 'dist')
+    assert len(manifest) == sum(len(files) for _, _, files in os.walk(dist))
+    for filename, hashed in manifest.items():
+        assert hashed.startswith(BUILD_DIR + '/')
+        with open(os.path.join(STATIC_FOLDER, filename), 'rb') as f:
+            shipped = f.read()
+        with open(os.path.join(static, hashed), 'rb') as f:
+            assert f.read() == shipped
+        if filename.endswith('.css'):
+            with open(os.path.join(static, hashed + '.gz'), 'rb') as f:
+                assert gzip.decompress(f.read()) == shipped
@@ -0,0 +1,56 @@
+'''Per-worker user cache, see src/login/cache.py.'''
+
+from src import user_cache
+from src.login.cache import UserCache
+
+from conftest import login
+from test_routes import mail_token
+
+
+def test_loader_misses_once_then_hits(client, make_user):
+
+    user_id = make_user('ann@example.com')
+    login(client, 'ann@example.com')
+
+    before = user_cache.stats()
+    assert client.get('/').status_code == 200
+    assert client.get('/profile').status_code == 200
+
+    stats = user_cache.stats()
+    assert stats['misses'] == before['misses'] + 1
+    assert stats['hits'] == before['hits'] + 1
+    assert user_cache.get(user_id).email == 'ann@example.com'
+
+
+def test_password_change_invalidates(app, client, make_user):
+
+    user_id = make_user('ann@example.com')
+    login(client, 'ann@example.com')
+    client.get('/')
+    assert user_cache.get(user_id) is not None
+
+    other = app.test_client()
+    other.post('/reset', data={'email': 'ann@example.com'})
+    other.post('/recover/' + mail_token(app, 'recover'),
+               data={'password': 'new-pass1', 'confirm': 'new-pass1'})
+    assert user_cache.get(user_id) is None
+
+
+def test_entries_expire_and_are_bounded():
+
+    cache = UserCache()
+    cache.ttl = -1
+    cache.set(1, 'ann')
+    assert cache.get(1) is None
+
+    cache.ttl, cache.size = 60, 2
+    cache.set(1, 'ann')
+    cache.set(2, 'bob')
+    assert cache.get(1) == 'ann'  # Now the most recent.
+    cache.set(3, 'cid')
+    assert cache.get(2) is None
+    assert (cache.get(1), cache.get('3')) == ('ann', 'cid')
+
+    cache.invalidate('1')
+    assert cache.get(1) is None
+    assert cache.stats() == {'hits': 3, 'misses': 3, 'size': 1}
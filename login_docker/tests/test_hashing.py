@@ -0,0 +1,67 @@
+'''Password hashing pool, see src/login/hashing.py.'''
+
+from threading import BoundedSemaphore, Event, Thread
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from src import db, hasher
+from src.login.hashing import HashQueueFull, HashService
+from src.models import User
+
+from conftest import login
+
+
+def test_full_queue_rejects_instead_of_waiting():
+
+    service = HashService()
+    service.workers, service.queue_depth = 1, 0
+    service._slots = BoundedSemaphore(1)
+
+    started, release = Event(), Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    results = []
+    thread = Thread(target=lambda: results.append(service.run(slow)))
+    thread.start()
+    assert started.wait(5)
+
+    with pytest.raises(HashQueueFull):
+        service.run(slow)
+
+    release.set()
+    thread.join(5)
+    assert results == ['done']
+    assert service.run(lambda: 'free again') == 'free again'
+
+
+def test_login_is_503_while_the_queue_is_full(client, make_user, monkeypatch):
+
+    make_user('ann@example.com')
+    monkeypatch.setattr(hasher, '_slots', BoundedSemaphore(1))
+    hasher._slots.acquire()
+
+    response = login(client, 'ann@example.com')
+    assert response.status_code == 503
+    assert b'The server is busy' in response.data
+
+
+@pytest.mark.parametrize('method', ['sha256', 'pbkdf2:sha256:500'])
+def test_outdated_hash_upgraded_at_login(app, client, make_user, method):
+
+    user_id = make_user('ann@example.com')
+    with app.app_context():
+        user = User.query.get(user_id)
+        user.password = generate_password_hash('secret12', method)
+        db.session.commit()
+
+    assert login(client, 'ann@example.com').status_code == 302
+    with app.app_context():
+        upgraded = User.query.get(user_id).password
+    assert upgraded.startswith(hasher.method + '$')
+    assert not hasher.needs_rehash(upgraded)
+    assert hasher.check(upgraded, 'secret12')
@@ -0,0 +1,66 @@
+'''Structured logging, see src/logs.py.'''
+
+import io
+import json
+import logging
+import sys
+
+from src.logs import JsonFormatter, SamplingFilter, logs
+
+
+def record(msg='Token %s rejected.', args=('abc',), **extra):
+
+    return logging.makeLogRecord(dict(
+        name='src.login.tokens', levelname='WARNING', levelno=30,
+        msg=msg, args=args, **extra))
+
+
+def test_json_line():
+
+    line = json.loads(JsonFormatter().format(
+        record(request_id='r1', user_id=None, status=401)))
+
+    assert set(line) == {
+        'ts', 'level', 'logger', 'message', 'request_id', 'status'}
+    assert line['message'] == 'Token abc rejected.'
+    assert (line['level'], line['logger']) == ('WARNING', 'src.login.tokens')
+    assert line['ts'].endswith('+00:00')
+
+
+def test_request_logged_with_its_context(client, monkeypatch):
+
+    output = io.StringIO()
+    monkeypatch.setattr(logs, 'slow', 0)
+    stdout = logs.output.setStream(output)
+    try:
+        response = client.get('/login/', headers={'X-Request-ID': 'req-1'})
+        logs.stop()  # Writes what is queued.
+    finally:
+        logs.output.setStream(stdout)
+
+    assert response.headers['X-Request-ID'] == 'req-1'
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    line = next(line for line in lines if line['logger'] == 'src.requests')
+    assert line['message'] == 'GET /login/ 200'
+    assert line['request_id'] == 'req-1'
+    assert (line['route'], line['method'], line['status']) == (
+        'auth_bp.login', 'GET', 200)
+    assert line['duration_ms'] >= 0
+    assert 'user_id' not in line  # Anonymous.
+
+
+def test_repeated_records_sampled(monkeypatch):
+
+    now = [100.0]
+    # src.logs the module, src exports the Logs instance under its name.
+    monkeypatch.setattr(sys.modules['src.logs'], 'monotonic', lambda: now[0])
+    sampling = SamplingFilter(burst=2)
+
+    assert [sampling.filter(record()) for _ in range(5)] == [
+        True, True, False, False, False]
+    assert sampling.filter(record(msg='Other.', args=None))
+
+    now[0] += 1
+    passed = record()
+    assert sampling.filter(passed)
+    assert passed.suppressed == 3
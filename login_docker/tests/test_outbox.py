@@ -0,0 +1,79 @@
+'''Mail outbox delivery.'''
+
+import pytest
+
+from src import db
+from src.mailer.outbox import MailDispatcher, OutboxMail, outbox
+
+
+class Connection:
+    '''SMTP stand-in failing for the 'bad@' recipients.'''
+
+    def __init__(self):
+
+        self.sent = []
+
+    def send(self, message):
+
+        if message.recipients[0].startswith('bad@'):
+            raise ValueError('Invalid recipient.')
+        self.sent.append(message.recipients[0])
+
+
+@pytest.fixture
+def dispatcher(app, monkeypatch):
+
+    with app.app_context():
+        dispatcher = MailDispatcher(app, outbox.mail)
+        connection = Connection()
+        monkeypatch.setattr(dispatcher, 'connection', lambda: connection)
+        dispatcher.sent = connection.sent
+        yield dispatcher
+
+
+def queue(*recipients):
+
+    for recipient in recipients:
+        db.session.add(OutboxMail(
+            sender='noreply@example.com', recipients=recipient,
+            subject='Hi', html='<p>Hi</p>'))
+    db.session.commit()
+
+
+def statuses():
+
+    return {m.recipients: (m.status, m.attempts) for m in OutboxMail.query}
+
+
+def test_failing_mail_does_not_block_the_queue(dispatcher):
+
+    queue('bad@example.com', 'ann@example.com', 'bob@example.com')
+
+    dispatcher.dispatch()
+
+    assert dispatcher.sent == ['ann@example.com', 'bob@example.com']
+    assert statuses() == {
+        'bad@example.com': ('pending', 1),
+        'ann@example.com': ('sent', 0),
+        'bob@example.com': ('sent', 0),
+    }
+
+
+def test_sent_mail_is_not_sent_again(dispatcher):
+
+    queue('ann@example.com')
+
+    dispatcher.dispatch()
+    dispatcher.dispatch()
+
+    assert dispatcher.sent == ['ann@example.com']
+
+
+def test_gives_up_after_max_attempts(dispatcher, monkeypatch):
+
+    monkeypatch.setattr(dispatcher, 'max_attempts', 1)
+    queue('bad@example.com')
+
+    dispatcher.dispatch()
+
+    assert statuses() == {'bad@example.com': ('failed', 1)}
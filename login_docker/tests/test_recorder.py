@@ -0,0 +1,54 @@
+'''Write-behind login recording, see src/login/recorder.py.'''
+
+from time import monotonic, sleep
+
+from src import user_cache
+from src.login.recorder import LoginEvent, recorder
+from src.models import User
+
+from conftest import login
+
+
+def last_login(app, user_id):
+
+    with app.app_context():
+        return User.query.get(user_id).last_login
+
+
+def test_logins_written_on_flush(app, make_user):
+
+    ann, bob = make_user('ann@example.com'), make_user('bob@example.com')
+    created = last_login(app, ann)
+
+    for email in ('ann@example.com', 'bob@example.com', 'ann@example.com'):
+        client = app.test_client()
+        assert login(client, email).status_code == 302
+        client.get('/')
+    assert user_cache.get(ann) is not None
+    assert last_login(app, ann) == created
+
+    assert recorder.flush() == 3
+    assert recorder.flush() == 0
+
+    # One last_login per user, one audit row per login.
+    assert last_login(app, ann) > created
+    assert user_cache.get(ann) is None
+    with app.app_context():
+        events = LoginEvent.query.order_by(LoginEvent.id).all()
+        assert [e.user_id for e in events] == [ann, bob, ann]
+        assert {e.method for e in events} == {'site'}
+        assert max(e.at for e in events) == User.query.get(ann).last_login
+
+
+def test_full_buffer_flushed_in_background(app, client, make_user,
+                                           monkeypatch):
+
+    user_id = make_user('ann@example.com')
+    created = last_login(app, user_id)
+    monkeypatch.setattr(recorder, 'size', 1)
+
+    login(client, 'ann@example.com')
+    deadline = monotonic() + 5
+    while last_login(app, user_id) == created and monotonic() < deadline:
+        sleep(.01)
+    assert last_login(app, user_id) > created
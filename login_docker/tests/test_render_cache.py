@@ -0,0 +1,73 @@
+'''Cached auth pages, see src/login/render_cache.py.'''
+
+import re
+
+import pytest
+
+from src import render_cache
+from src.login.render_cache import CSRF_SLOT, FLASH_SLOT
+
+
+@pytest.fixture
+def csrf(app, monkeypatch):
+
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+
+
+def csrf_token(page: bytes):
+
+    return re.search(
+        rb'id="csrf_token" name="csrf_token" type="hidden" value="([^"]+)"',
+        page).group(1).decode()
+
+
+def counts():
+
+    stats = render_cache.stats()
+    return stats['hits'], stats['misses']
+
+
+def test_page_rendered_once(client):
+
+    hits, misses = counts()
+    first = client.get('/login/')
+    second = client.get('/login/')
+
+    assert first.data == second.data
+    assert counts() == (hits + 1, misses + 1)
+    client.post('/login/', data={'email': 'ann@example.com'})
+    assert counts() == (hits + 1, misses + 1)
+
+
+def test_csrf_token_spliced_per_session(app, client, make_user, csrf):
+
+    make_user('ann@example.com')
+    other = app.test_client()
+    assert other.get('/login/').status_code == 200
+
+    hits, misses = counts()
+    page = client.get('/login/').data
+    assert counts() == (hits + 1, misses)
+    assert CSRF_SLOT.encode() not in page
+
+    # The token is the session's own, the cached page any other's.
+    token = csrf_token(page)
+    assert token != csrf_token(other.get('/login/').data)
+    response = client.post('/login/', data={
+        'email': 'ann@example.com', 'password': 'secret12',
+        'csrf_token': token})
+    assert response.status_code == 302
+
+
+def test_flashes_spliced_per_request(app, client):
+
+    _, misses = counts()
+    assert FLASH_SLOT.encode() not in app.test_client().get('/login/').data
+
+    # Flashes 'Log in to view this page.', shown on the next page only.
+    client.get('/profile')
+    page = client.get('/login/').data
+    assert b'Log in to view this page.' in page
+    assert FLASH_SLOT.encode() not in page
+    assert b'Log in to view this page.' not in client.get('/login/').data
+    assert counts()[1] == misses + 1
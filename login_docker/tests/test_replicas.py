@@ -0,0 +1,79 @@
+'''Read replica routing, see src/replicas.py.'''
+
+import pytest
+from flask import session
+from flask_sqlalchemy import get_state
+from sqlalchemy import event
+
+from src import db, replicas
+from src.models import CreateUser, User
+from src.replicas import PIN_KEY, RoutingSession
+
+
+@pytest.fixture
+def replica(app, make_user, monkeypatch, tmp_path):
+    '''A replica bind where ann is named 'Replica', 'Primary' on the primary.'''
+
+    make_user('ann@example.com')
+    with app.app_context():
+        User.query.filter_by(email='ann@example.com').update(
+            {'name': 'Primary'})
+        db.session.commit()
+
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS', {
+        'replica0': 'sqlite:///{}/replica.db'.format(tmp_path)})
+    monkeypatch.setattr(replicas, 'binds', ['replica0'])
+    event.listen(RoutingSession, 'after_flush', replicas.wrote)
+
+    with app.app_context():
+        engine = db.get_engine(app, bind='replica0')
+        User.__table__.create(engine)
+        engine.execute(User.__table__.insert(), {
+            'name': 'Replica', 'email': 'ann@example.com',
+            'email_key': 'ann@example.com', 'password': '!',
+            'login_type': 'site', 'confirmed': True})
+
+    yield
+
+    event.remove(RoutingSession, 'after_flush', replicas.wrote)
+    get_state(app).connectors.pop('replica0').get_engine().dispose()
+
+
+def ann():
+
+    return User.query.filter_by(email_key='ann@example.com').one().name
+
+
+def test_reads_in_reading_go_to_a_replica(app, replica):
+
+    with app.test_request_context():
+        assert ann() == 'Primary'
+        with replicas.reading():
+            assert ann() == 'Replica'
+        assert ann() == 'Primary'
+        assert User.lookup('ann@example.com', replica=True).name == 'Replica'
+
+
+def test_writes_go_to_the_primary_and_pin_it(app, replica):
+
+    with app.test_request_context():
+        with replicas.reading():
+            CreateUser(email='bob@example.com').create(
+                name='Bob', login_type='site', password='secret12')
+        assert User.query.filter_by(email='bob@example.com').count() == 1
+
+        # Pinned: this browser reads its own write.
+        assert session[PIN_KEY] > 0
+        with replicas.reading():
+            assert ann() == 'Primary'
+
+        session[PIN_KEY] = 0
+        with replicas.reading():
+            assert ann() == 'Replica'
+
+
+def test_no_replicas_reads_the_primary(app):
+
+    with app.test_request_context():
+        with replicas.reading():
+            assert db.session.info.get('replica') is None
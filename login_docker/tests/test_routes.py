@@ -0,0 +1,210 @@
+'''Auth and main page flows, each within its view's query budget.'''
+
+import re
+
+import pytest
+
+from src import db
+from src.mailer.outbox import OutboxMail
+from src.login.tokens import tokens
+from src.models import User
+from src.queries import QueryBudgetExceeded
+
+from conftest import login
+
+
+SIGNUP = {
+    'name': 'Ann', 'email': 'ann@example.com',
+    'password': 'secret12', 'confirm': 'secret12'
+}
+
+
+def mail_token(app, route: str):
+    '''Token of the last queued mail linking to /<route>/.'''
+
+    with app.app_context():
+        mail = OutboxMail.query.order_by(OutboxMail.id.desc()).first()
+        return re.search(r'/{}/([^"\s&]+)'.format(route), mail.html).group(1)
+
+
+def get_user(app, email: str):
+
+    with app.app_context():
+        user = User.query.filter_by(email=email).first()
+        if user is not None:
+            db.session.expunge(user)
+        return user
+
+
+def test_signup_creates_unconfirmed_user_and_queues_mail(app, client):
+
+    assert client.post('/signup', data=SIGNUP).status_code == 200
+
+    user = get_user(app, 'ann@example.com')
+    assert user.email_key == 'ann@example.com'
+    assert not user.confirmed and user.signup
+    with app.app_context():
+        mail = OutboxMail.query.one()
+        assert mail.recipients == 'ann@example.com'
+        assert '/confirm/' in mail.html
+
+
+def test_signup_existing_email(app, client, make_user):
+
+    make_user('Ann@Example.com')
+    response = client.post('/signup', data=SIGNUP)
+
+    assert b'User exists.' in response.data
+    with app.app_context():
+        assert User.query.count() == 1
+
+
+def test_login_main_profile_logout(client, make_user):
+
+    make_user('ann@example.com')
+
+    response = login(client, 'ANN@example.com')
+    assert response.status_code == 302
+    assert response.location.endswith('/')
+
+    assert client.get('/').status_code == 200
+    assert b'ann@example.com' in client.get('/profile').data
+
+    assert client.get('/logout').status_code == 302
+    assert client.get('/profile').status_code == 302
+
+
+def test_login_rejects_wrong_password_and_unconfirmed(client, make_user):
+
+    make_user('ann@example.com')
+    make_user('bob@example.com', confirmed=False)
+
+    assert login(client, 'ann@example.com', 'wrong-pw').status_code == 200
+    assert login(client, 'bob@example.com').status_code == 200
+    assert client.get('/').status_code == 302
+
+
+def test_confirm_link_logs_in_once(app, client):
+
+    client.post('/signup', data=SIGNUP)
+    token = mail_token(app, 'confirm')
+
+    assert client.get('/confirm/' + token).status_code == 302
+    assert get_user(app, 'ann@example.com').confirmed
+    assert client.get('/').status_code == 200
+
+    other = app.test_client()
+    response = other.get('/confirm/' + token)
+    assert response.location.endswith('/login/')
+
+
+def test_reset_and_recover(app, client, make_user):
+
+    make_user('ann@example.com', password='old-pass1')
+
+    assert client.post(
+        '/reset', data={'email': 'ann@example.com'}).status_code == 200
+    token = mail_token(app, 'recover')
+
+    assert client.get('/recover/' + token).status_code == 200
+    new = {'password': 'new-pass1', 'confirm': 'new-pass1'}
+    assert client.post('/recover/' + token, data=new).status_code == 302
+
+    # The link changes the password once.
+    assert client.post(
+        '/recover/' + token, data=new).location.endswith('/login/')
+    assert login(client, 'ann@example.com', 'old-pass1').status_code == 200
+    assert login(client, 'ann@example.com', 'new-pass1').status_code == 302
+
+
+def test_reset_unknown_email_queues_nothing(app, client):
+
+    client.post('/reset', data={'email': 'nobody@example.com'})
+
+    with app.app_context():
+        assert OutboxMail.query.count() == 0
+
+
+def test_delete_profile(app, client, make_user):
+
+    make_user('ann@example.com')
+    assert login(client, 'ann@example.com').status_code == 302
+
+    response = client.post('/delete_profile')
+    assert response.location.endswith('/login/')
+    assert get_user(app, 'ann@example.com') is None
+
+
+def bearer(token):
+
+    if isinstance(token, bytes):
+        token = token.decode()
+    return {'Authorization': 'Bearer ' + token}
+
+
+def issued_token(app, email: str, password: str = 'secret12'):
+    '''Access token from POST /auth/token, on a client of its own.'''
+
+    client = app.test_client()
+    login(client, email, password)
+    response = client.post('/auth/token')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    body = response.get_json()
+    assert body['token_type'] == 'Bearer'
+    assert body['expires_in'] == app.config['ACCESS_TOKEN_TTL']
+    return body['access_token']
+
+
+def test_verify_session_and_access_token(app, client, make_user):
+
+    make_user('ann@example.com')
+    assert client.get('/auth/verify').status_code == 401
+    assert client.post('/auth/token').status_code == 302
+
+    headers = bearer(issued_token(app, 'ann@example.com'))
+    response = client.get('/auth/verify', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-Auth-User-Email'] == 'ann@example.com'
+
+    login(client, 'ann@example.com')
+    assert client.get('/auth/verify').status_code == 200
+
+
+def test_verify_rejects_link_tokens_and_unconfirmed_users(
+        app, client, make_user):
+
+    make_user('ann@example.com')
+    make_user('bob@example.com', confirmed=False)
+
+    with app.app_context():
+        links = [tokens.create('ann@example.com', purpose, version=0)
+                 for purpose in ('confirm', 'recover')]
+        unconfirmed = tokens.create('bob@example.com', 'access', version=0)
+    for token in links + [unconfirmed]:
+        response = client.get('/auth/verify', headers=bearer(token))
+        assert response.status_code == 401
+
+
+def test_password_recovery_revokes_access_tokens(app, client, make_user):
+
+    make_user('ann@example.com')
+    headers = bearer(issued_token(app, 'ann@example.com'))
+
+    client.post('/reset', data={'email': 'ann@example.com'})
+    client.post('/recover/' + mail_token(app, 'recover'),
+                data={'password': 'new-pass1', 'confirm': 'new-pass1'})
+
+    assert client.get('/auth/verify', headers=headers).status_code == 401
+    headers = bearer(issued_token(app, 'ann@example.com', 'new-pass1'))
+    assert client.get('/auth/verify', headers=headers).status_code == 200
+
+
+def test_over_budget_route_fails(app, client, make_user, monkeypatch):
+
+    make_user('ann@example.com')
+    view = app.view_functions['auth_bp.login']
+    monkeypatch.setattr(view, 'query_budgets', {'POST': {'SELECT': 0}})
+
+    with pytest.raises(QueryBudgetExceeded):
+        login(client, 'ann@example.com')
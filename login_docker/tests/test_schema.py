@@ -0,0 +1,13 @@
+'''Schema migration commands, see src/schema.py.'''
+
+
+def test_status_and_upgrade_commands(app):
+
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['schema', 'status'])
+    assert result.exit_code == 0
+    assert result.output == 'Pending: nothing\n'
+
+    result = runner.invoke(args=['schema', 'upgrade'])
+    assert result.output == 'Applied: nothing\n'
@@ -0,0 +1,85 @@
+'''Signed session claims, see src/login/session.py.'''
+
+import pytest
+
+from src import user_cache
+from src.login.session import CLAIMS_KEY
+
+from conftest import login
+from test_routes import mail_token
+
+
+@pytest.fixture
+def claims(app, monkeypatch):
+
+    monkeypatch.setitem(app.config, 'SESSION_CLAIMS', True)
+
+
+def session_claims(client):
+
+    with client.session_transaction() as session:
+        return session.get(CLAIMS_KEY)
+
+
+def test_logout_recover_login(app, client, make_user, claims, monkeypatch):
+
+    # Claims expire at once, every request checks the session version.
+    monkeypatch.setitem(app.config, 'SESSION_CLAIMS_TTL', 0)
+    make_user('ann@example.com', password='old-pass1')
+
+    login(client, 'ann@example.com', 'old-pass1')
+    old = session_claims(client)
+    assert client.get('/logout').status_code == 302
+    assert session_claims(client) is None
+
+    # Recovering the password bumps the session version.
+    client.post('/reset', data={'email': 'ann@example.com'})
+    token = mail_token(app, 'recover')
+    client.post('/recover/' + token,
+                data={'password': 'new-pass1', 'confirm': 'new-pass1'})
+
+    assert login(client, 'ann@example.com', 'new-pass1').status_code == 302
+    new = session_claims(client)
+    assert new['ver'] == old['ver'] + 1
+    for _ in range(2):
+        assert client.get('/').status_code == 200
+
+
+def test_claims_serve_current_user(app, client, make_user, claims):
+
+    make_user('ann@example.com')
+    login(client, 'ann@example.com')
+    assert session_claims(client)['email'] == 'ann@example.com'
+
+    misses = user_cache.stats()['misses']
+    assert b'ann@example.com' in client.get('/profile').data
+    assert user_cache.stats()['misses'] == misses
+
+
+def test_recovery_revokes_other_sessions(app, client, make_user, claims,
+                                         monkeypatch):
+
+    monkeypatch.setitem(app.config, 'SESSION_CLAIMS_TTL', 0)
+    make_user('ann@example.com')
+    login(client, 'ann@example.com')
+    assert client.get('/').status_code == 200
+
+    other = app.test_client()
+    other.post('/reset', data={'email': 'ann@example.com'})
+    other.post('/recover/' + mail_token(app, 'recover'),
+               data={'password': 'new-pass1', 'confirm': 'new-pass1'})
+
+    response = client.get('/')
+    assert response.location.endswith('/login/')
+    assert session_claims(client) is None
+    assert client.get('/').status_code == 302
+
+
+def test_login_without_claims_drops_stale_ones(client, make_user):
+
+    make_user('ann@example.com')
+    with client.session_transaction() as session:
+        session[CLAIMS_KEY] = {'id': 0, 'ver': 0}
+
+    login(client, 'ann@example.com')
+    assert session_claims(client) is None
@@ -0,0 +1,52 @@
+'''Expired state sweeping, see src/sweeper.py.'''
+
+import datetime
+
+import pytest
+
+from src import db, store
+from src.models import User
+from src.sweeper import sweeper
+
+
+@pytest.fixture
+def batches(monkeypatch):
+
+    monkeypatch.setattr(sweeper, 'batch_size', 2)
+    monkeypatch.setattr(sweeper, 'pause_seconds', 0)
+
+
+def age(app, days: int, *ids):
+
+    created = datetime.datetime.now() - datetime.timedelta(days=days)
+    with app.app_context():
+        User.query.filter(User.id.in_(ids)).update(
+            {'created': created}, synchronize_session=False)
+        db.session.commit()
+
+
+def test_stale_signups_deleted_in_batches(app, make_user, batches):
+
+    stale = [make_user('{}@example.com'.format(i), confirmed=False,
+                       signup=True) for i in range(5)]
+    recent = make_user('new@example.com', confirmed=False, signup=True)
+    confirmed = make_user('ann@example.com', signup=True)
+    imported = make_user('bob@example.com', confirmed=False)
+    age(app, 30, confirmed, imported, *stale)
+
+    with app.app_context():
+        assert sweeper.sweep(['unconfirmed_users']) == {
+            'unconfirmed_users': 5}
+        assert sorted(u.id for u in User.query) == sorted(
+            [recent, confirmed, imported])
+
+
+def test_once_command(app, make_user, batches):
+
+    user_id = make_user('new@example.com', confirmed=False, signup=True)
+    age(app, 8, user_id)
+    store.add('throttle:gone', -1)
+
+    result = app.test_cli_runner().invoke(args=['sweep', 'once'])
+    assert result.output.splitlines() == [
+        'unconfirmed_users: 1 removed', 'shared_store: 1 removed']
@@ -0,0 +1,52 @@
+'''Auth form throttling.'''
+
+from src.login.throttle import throttle
+
+from conftest import login
+
+
+def test_login_throttled_per_email(app, client, make_user, monkeypatch):
+
+    make_user('ann@example.com')
+    monkeypatch.setitem(app.config, 'THROTTLE_LOGIN_EMAIL', '2/60')
+
+    for _ in range(2):
+        assert login(client, 'ann@example.com', 'wrong-pw').status_code == 200
+    response = login(client, 'ann@example.com', 'wrong-pw')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+    # Counted per email, and case-insensitively.
+    assert login(client, 'ANN@example.com').status_code == 429
+    assert login(client, 'bob@example.com').status_code == 200
+
+
+def test_reset_throttled_per_ip(app, client, monkeypatch):
+
+    monkeypatch.setitem(app.config, 'THROTTLE_RESET_IP', '1/60')
+    data = {'email': 'ann@example.com'}
+
+    assert client.post('/reset', data=data).status_code == 200
+    assert client.post('/reset', data=data).status_code == 429
+    assert client.get('/reset').status_code == 200
+
+
+def test_forwarded_for_not_trusted_without_proxy(app, client, monkeypatch):
+
+    monkeypatch.setitem(app.config, 'THROTTLE_RESET_IP', '1/60')
+    data = {'email': 'ann@example.com'}
+
+    assert client.post('/reset', data=data).status_code == 200
+    response = client.post(
+        '/reset', data=data, headers={'X-Forwarded-For': '203.0.113.9'})
+    assert response.status_code == 429
+
+
+def test_disabled(app, client, monkeypatch):
+
+    monkeypatch.setattr(throttle, 'enabled', False)
+    monkeypatch.setitem(app.config, 'THROTTLE_RESET_IP', '1/60')
+
+    for _ in range(3):
+        assert client.post(
+            '/reset', data={'email': 'a@example.com'}).status_code == 200
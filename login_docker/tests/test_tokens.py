@@ -0,0 +1,84 @@
+'''Confirm and recover link tokens.'''
+
+from time import time
+
+import jwt
+import pytest
+
+from src.login.tokens import TokenService, tokens
+
+
+@pytest.fixture
+def ctx(app):
+
+    with app.app_context():
+        yield
+
+
+def test_verify_returns_the_email(ctx):
+
+    token = tokens.create('ann@example.com', 'confirm')
+    assert tokens.verify(token, 'confirm') == 'ann@example.com'
+
+
+def test_token_only_valid_for_its_purpose(ctx):
+
+    token = tokens.create('ann@example.com', 'recover')
+    assert tokens.verify(token, 'access') is False
+    assert tokens.verify(token, 'confirm') is False
+    assert tokens.verify(token, 'recover') == 'ann@example.com'
+
+    with pytest.raises(ValueError):
+        tokens.create('ann@example.com', 'admin')
+
+
+def test_token_is_spent_once(ctx):
+
+    token = tokens.create('ann@example.com', 'confirm')
+
+    assert tokens.verify(token, 'confirm', spend=True) == 'ann@example.com'
+    assert tokens.verify(token, 'confirm') is False
+    assert tokens.verify(token, 'confirm', spend=True) is False
+
+
+def test_expired_tampered_and_missing_tokens(ctx):
+
+    expired = tokens.create('ann@example.com', 'confirm', expires=-10)
+    assert tokens.verify(expired, 'confirm') is False
+    tampered = tokens.create('ann@example.com', 'confirm')[:-2]
+    assert tokens.verify(tampered, 'confirm') is False
+    assert tokens.verify('', 'confirm') is False
+    assert tokens.verify(None, 'confirm') is False
+
+
+def test_unknown_kid_and_other_algorithm(ctx):
+
+    claims = {'email': 'ann@example.com', 'typ': 'confirm',
+              'exp': time() + 60, 'jti': 'x'}
+    assert tokens.verify(jwt.encode(
+        claims, 'test-secret', headers={'kid': 'old'}), 'confirm') is False
+    assert tokens.verify(jwt.encode(
+        claims, 'test-secret', algorithm='HS512'), 'confirm') is False
+
+
+def test_rotated_key_still_verifies(ctx, monkeypatch):
+
+    old = TokenService.parse_keys('old:old-secret', None)
+    monkeypatch.setattr(tokens, 'keys', old[0])
+    monkeypatch.setattr(tokens, 'kid', old[1])
+    token = tokens.create('ann@example.com', 'confirm')
+
+    keys, kid = TokenService.parse_keys('new:new-secret,old:old-secret', None)
+    monkeypatch.setattr(tokens, 'keys', keys)
+    monkeypatch.setattr(tokens, 'kid', kid)
+    assert tokens.verify(token, 'confirm') == 'ann@example.com'
+    new = tokens.create('b@example.com', 'confirm')
+    assert jwt.get_unverified_header(new)['kid'] == 'new'
+
+
+def test_parse_keys():
+
+    assert TokenService.parse_keys('', 'secret') == (
+        {'default': 'secret'}, 'default')
+    with pytest.raises(ValueError):
+        TokenService.parse_keys('no-secret', None)
@@ -0,0 +1,86 @@
+'''Bulk user import and export, see src/transfer.py.'''
+
+import json
+
+import pytest
+
+from src import hasher
+from src.models import User
+
+from conftest import login
+
+
+ROWS = '''email,name,password,password_hash,login_type,confirmed,created
+ann@example.com,Ann,secret12,,,,2020-01-02T03:04:05
+BOB@example.com,Bob,secret12,,,,
+Ann@Example.com ,Ann again,secret12,,,,
+cid@example.com,Cid,,,google,false,
+dan@example.com,Dan,,,,,
+eve@example.com,,secret12,,,,
+not-an-email,Fay,secret12,,,,
+gus@example.com,Gus,,not-a-hash,,,
+hal@example.com,Hal,secret12,,,,yesterday
+ivy@example.com,Ivy,,{hash},,0,
+'''
+
+
+@pytest.fixture
+def runner(app):
+
+    return app.test_cli_runner()
+
+
+def test_import_dedupes_and_rejects_rows(app, runner, make_user, tmp_path):
+
+    make_user('bob@example.com')
+    path = tmp_path / 'users.csv'
+    path.write_text(ROWS.format(hash=hasher.generate('secret34')))
+
+    result = runner.invoke(args=[
+        'users', 'import', str(path), '--batch-size', '3', '--workers', '1',
+        '--hash-iterations', '500'])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 3 of 10 rows (7 skipped)' in result.output
+
+    with app.app_context():
+        users = {u.email_key: u for u in User.query}
+        assert sorted(users) == [
+            'ann@example.com', 'bob@example.com', 'cid@example.com',
+            'ivy@example.com']
+        ann = users['ann@example.com']
+        cid, ivy = users['cid@example.com'], users['ivy@example.com']
+        assert ann.name == 'Ann' and ann.confirmed and not ann.signup
+        assert ann.created.isoformat() == '2020-01-02T03:04:05'
+        assert ann.password.startswith('pbkdf2:sha256:500$')
+        assert cid.login_type == 'google' and cid.confirmed
+        assert not ivy.confirmed
+
+    # Imported hashes are upgraded at the first login.
+    assert login(app.test_client(), 'ann@example.com').status_code == 302
+    with app.app_context():
+        password = User.query.get(ann.id).password
+        assert password.startswith(hasher.method + '$')
+
+
+def test_export_in_keyset_batches(app, runner, make_user, tmp_path):
+
+    ids = [make_user('{}@example.com'.format(name))
+           for name in ('ann', 'bob', 'cid', 'dan', 'eve')]
+    path = tmp_path / 'users.jsonl'
+
+    result = runner.invoke(args=[
+        'users', 'export', str(path), '--batch-size', '2',
+        '--since-id', str(ids[0])])
+    assert 'Exported 4 rows' in result.output
+
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [row['id'] for row in rows] == ids[1:]
+    assert rows[0]['email'] == 'bob@example.com'
+    assert 'password' not in rows[0]
+
+    runner.invoke(args=[
+        'users', 'export', str(path), '--format', 'csv', '--with-hashes'])
+    lines = path.read_text().splitlines()
+    assert lines[0] == (
+        'id,email,name,login_type,confirmed,created,last_login,password')
+    assert len(lines) == 6